@@ -0,0 +1,55 @@
+""" Times the assignment layout method against the nearest method it improves on, on clustered synthetic inputs of
+    10k to 30k areas, and reports the total and maximum displacement of each. Run from the repository root:
+
+        python benchmarks/assignment.py [--sizes 10000 20000 30000] [--kind clustered] [--fill 0.4]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from eqcart import Cartogram
+from suite import KINDS, synthetic_points
+
+METHODS = ('nearest', 'assignment')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 20000, 30000], help='numbers of areas')
+    parser.add_argument('--kind', default='clustered', choices=KINDS, help='kind of synthetic input')
+    parser.add_argument('--fill', type=float, default=0.4, help='fraction of the grid filled by the areas')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    warnings.filterwarnings('ignore')
+
+    tmpdir = tempfile.mkdtemp()
+    print('{:<18} {:>7} {:<11} {:>9} {:>12} {:>8}'.format('input', 'areas', 'method', 'layout s', 'total disp',
+                                                            'max disp'))
+    try:
+        for num_areas in args.sizes:
+            fname = os.path.join(tmpdir, '{}_{}.csv'.format(args.kind, num_areas))
+            synthetic_points(args.kind, num_areas, args.seed).to_csv(fname, index=False)
+            side = int(np.ceil(np.sqrt(num_areas / args.fill)))
+            for method in METHODS:
+                cart = Cartogram(fname, 'area', side, side)
+                cart._initialize_grid()
+                start = time.perf_counter()
+                cart._place_new_grid(method)
+                seconds = time.perf_counter() - start
+                cart._measure_displacement()
+                print('{:<18} {:>7} {:<11} {:>9.2f} {:>12.1f} {:>8.2f}'.format(
+                    '{}-{}'.format(args.kind, num_areas), num_areas, method, seconds, cart.total_displacement,
+                    cart.max_displacement))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+""" Compares the size and write time of the GeoJSON, TopoJSON and Parquet outputs on the files in sample_data and on a
+    synthetic input. Run from the repository root:
+
+        python benchmarks/formats.py [--areas 10000] [--repeat 3]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from eqcart import Cartogram
+from suite import SAMPLES, synthetic_points
+
+WRITERS = [('geojson', '.geojson', 'make_hex_geojson'), ('topojson', '.topojson', 'make_hex_topojson'),
+           ('parquet', '.parquet', 'make_hex_table')]
+
+
+def measure(cart, tmpdir, repeat):
+    # (bytes, fastest seconds) of every output, for a cart that has been laid out
+    results = {}
+    for name, extension, writer in WRITERS:
+        fname = os.path.join(tmpdir, 'out' + extension)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            getattr(cart, writer)(fname, method='keep')
+            times.append(time.perf_counter() - start)
+        results[name] = (os.path.getsize(fname), min(times))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--areas', type=int, default=10000, help='number of synthetic areas (0 to skip)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement; the fastest is reported')
+    args = parser.parse_args()
+    warnings.filterwarnings('ignore')
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    tmpdir = tempfile.mkdtemp()
+    cases = [(fname, os.path.join(root, 'sample_data', fname), id_col, num_x_grid, num_y_grid)
+             for fname, id_col, num_x_grid, num_y_grid in SAMPLES]
+    if args.areas:
+        fname = os.path.join(tmpdir, 'uniform.csv')
+        synthetic_points('uniform', args.areas).to_csv(fname, index=False)
+        side = int((args.areas / 0.3) ** 0.5)
+        cases.append(('uniform-{}'.format(args.areas), fname, 'area', side, side))
+
+    print('{:<22} {:>6} {:>12} {:>9} {:>12} {:>9} {:>12} {:>9}'.format(
+        'input', 'areas', 'geojson B', 's', 'topojson B', 's', 'parquet B', 's'))
+    try:
+        for name, fname, id_col, num_x_grid, num_y_grid in cases:
+            cart = Cartogram(fname, id_col, num_x_grid, num_y_grid)
+            cart._layout('nearest')
+            results = measure(cart, tmpdir, args.repeat)
+            print('{:<22} {:>6} '.format(name, len(cart.df)) + ' '.join(
+                '{:>12} {:>9.4f}'.format(*results[writer]) for writer, _, _ in WRITERS))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
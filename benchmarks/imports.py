@@ -0,0 +1,82 @@
+""" Checks that importing eqcart stays cheap. Every measurement runs in a fresh interpreter:
+        - the time `import eqcart` takes beyond importing numpy and pandas, which the CSV path needs anyway, must be
+          under --budget seconds
+        - importing eqcart and rendering a CSV input to SVG and GeoJSON must not import geopandas, shapely, IPython or
+          any of the other modules in LAZY
+    Exits with status 1 if either check fails. Run from the repository root:
+
+        python benchmarks/imports.py [--budget 0.15] [--repeat 7]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that only geometry inputs, notebooks or optional outputs should load
+LAZY = ['geopandas', 'shapely', 'fiona', 'pyogrio', 'IPython', 'bs4', 'lxml', 'scipy']
+
+TIME_IMPORT = """
+import time
+start = time.perf_counter()
+import {}
+print(time.perf_counter() - start)
+"""
+
+CSV_RENDER = """
+import sys
+from eqcart import Cartogram
+cart = Cartogram({fname!r}, 'area', 20, 30)
+cart.make_hex_svg({svg!r})
+cart.make_hex_geojson({geojson!r}, method='keep')
+print(' '.join(module for module in {lazy!r} if module in sys.modules))
+"""
+
+
+def run(code):
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    return subprocess.run([sys.executable, '-c', code], env=env, check=True, capture_output=True,
+                          text=True).stdout.strip()
+
+
+def import_seconds(modules, repeat):
+    # the median time of importing modules in a fresh interpreter
+    return statistics.median(float(run(TIME_IMPORT.format(modules))) for _ in range(repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget', type=float, default=0.15,
+                        help='seconds import eqcart may take beyond numpy and pandas')
+    parser.add_argument('--repeat', type=int, default=7, help='interpreters per measurement; the median is used')
+    args = parser.parse_args()
+
+    # numpy and pandas are imported first so that the second measurement only times eqcart itself
+    dependencies = import_seconds('numpy, pandas', args.repeat)
+    total = import_seconds('numpy, pandas; import eqcart', args.repeat)
+    own = total - dependencies
+    print('import numpy, pandas: {:.3f}s'.format(dependencies))
+    print('import eqcart:        {:.3f}s more (budget {:.3f}s)'.format(own, args.budget))
+
+    tmpdir = tempfile.mkdtemp()
+    loaded = run(CSV_RENDER.format(fname=os.path.join(ROOT, 'sample_data', 'in_pollution.csv'),
+                                   svg=os.path.join(tmpdir, 'out.svg'), geojson=os.path.join(tmpdir, 'out.geojson'),
+                                   lazy=LAZY)).split()
+    for name in os.listdir(tmpdir):
+        os.remove(os.path.join(tmpdir, name))
+    os.rmdir(tmpdir)
+    print('loaded by a CSV render: {}'.format(', '.join(loaded) or 'none of {}'.format(', '.join(LAZY))))
+
+    failed = own > args.budget or loaded
+    if own > args.budget:
+        print('FAILED: import eqcart is over budget')
+    if loaded:
+        print('FAILED: a CSV render imported {}'.format(', '.join(loaded)))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
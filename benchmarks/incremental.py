@@ -0,0 +1,84 @@
+""" Compares Cartogram.update_layout on a small delta against a full re-layout of the edited input. The delta adds,
+    removes and moves equal numbers of areas of one of the synthetic inputs of benchmarks/suite.py. Run from the
+    repository root:
+
+        python benchmarks/incremental.py [--areas 10000] [--delta 0.01] [--kind clustered] [--method shunt]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from eqcart import Cartogram
+from suite import KINDS, synthetic_points
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--areas', type=int, default=10000)
+    parser.add_argument('--delta', type=float, default=0.01, help='fraction of areas added, removed or moved')
+    parser.add_argument('--kind', default='clustered', choices=KINDS, help='kind of synthetic input')
+    parser.add_argument('--method', default='shunt', choices=['shunt', 'nearest', 'assignment'])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    side = int(np.ceil(np.sqrt(args.areas * 1.5)))
+    per_kind = max(1, int(args.areas * args.delta / 3))
+    # the added areas are drawn along with the others, so they follow the same distribution and have their own ids
+    points = synthetic_points(args.kind, args.areas + per_kind, args.seed)
+    before, added = points.iloc[:args.areas].copy(), points.iloc[args.areas:]
+    # keep the extreme points in place so that both editions are binned on the same grid
+    extremes = set(before.loc[[before.latitude.idxmin(), before.latitude.idxmax(),
+                               before.longitude.idxmin(), before.longitude.idxmax()], 'area'])
+    editable = before.index[~before.area.isin(extremes)]
+    picked = rng.choice(editable, 2 * per_kind, replace=False)
+    removed, changed = before.loc[picked[:per_kind], 'area'], before.loc[picked[per_kind:], 'area']
+    after = before[~before.area.isin(removed)].copy()
+    moved = after.area.isin(changed)
+    after.loc[moved, 'latitude'] += rng.normal(0, 0.2, moved.sum())
+    after.loc[moved, 'longitude'] += rng.normal(0, 0.2, moved.sum())
+    after = pd.concat([after, added], ignore_index=True)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        before_fname, after_fname = os.path.join(tmpdir, 'before.csv'), os.path.join(tmpdir, 'after.csv')
+        before.to_csv(before_fname, index=False)
+        after.to_csv(after_fname, index=False)
+
+        old = Cartogram(before_fname, 'area', side, side)
+        old._layout(args.method)
+
+        full = Cartogram(after_fname, 'area', side, side)
+        start = time.perf_counter()
+        full._layout(args.method)
+        full_time = time.perf_counter() - start
+
+        incremental = Cartogram(after_fname, 'area', side, side)
+        start = time.perf_counter()
+        incremental.update_layout(old.df, added=added.area, removed=removed, changed=changed)
+        incremental_time = time.perf_counter() - start
+    finally:
+        shutil.rmtree(tmpdir)
+
+    # how many of the areas that did not change ended up on a different hex
+    unchanged = ~after.area.isin(changed) & ~after.area.isin(added.area)
+    previous = old.df.set_index('area')[['hex_x', 'hex_y']]
+    for name, cart in [('full re-layout', full), ('update_layout', incremental)]:
+        now = cart.df.set_index('area').loc[after.area[unchanged], ['hex_x', 'hex_y']]
+        moved_hexes = (now != previous.loc[now.index]).any(axis=1).sum()
+        seconds = full_time if cart is full else incremental_time
+        print('{:<16} {:>8.3f}s  total displacement {:>10.1f}  unchanged areas moved {:>6}'.format(
+            name, seconds, cart.total_displacement, moved_hexes))
+    print('{} areas, {} added, {} removed, {} moved: update_layout is {:.1f}x faster'.format(
+        args.areas, per_kind, per_kind, per_kind, full_time / incremental_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+""" Compares the row-wise ingest and binning Cartogram used to do against the current vectorized version, and against
+    the chunked ingest (chunk_size), on sample_data/countries.geo.json and on a synthetic file of small square polygons.
+    The peak memory of the current and chunked ingests is measured in separate processes. Run from the repository root:
+
+        python benchmarks/ingest.py [--areas 100000] [--repeat 3] [--chunk-size 10000]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from eqcart import Cartogram
+
+
+def legacy_ingest(fname, num_x_grid, num_y_grid):
+    # Cartogram.__init__ and _initialize_grid as they were before vectorization
+    df = gpd.read_file(fname)
+    df['centroid'] = df['geometry'].apply(lambda x: x.centroid)
+    df['longitude'] = df['centroid'].apply(lambda x: x.coords.xy[0][0])
+    df['latitude'] = df['centroid'].apply(lambda x: x.coords.xy[1][0])
+    xmax, xmin = df['longitude'].max(), df['longitude'].min()
+    ymax, ymin = df['latitude'].max(), df['latitude'].min()
+    x_range = xmax - xmin
+    y_range = ymax - ymin
+    df["x_bin"] = df["longitude"].apply(lambda x: int(num_x_grid * (x - xmin) / x_range))
+    df["y_bin"] = df["latitude"].apply(lambda y: int(num_y_grid * (ymax - y) / y_range))
+    return df
+
+
+def current_ingest(fname, id_col, num_x_grid, num_y_grid, chunk_size=None):
+    cart = Cartogram(fname, id_col, num_x_grid, num_y_grid, chunk_size=chunk_size)
+    cart._initialize_grid()
+    return cart.df
+
+
+def peak_megabytes(fname, id_col, num_x_grid, num_y_grid, chunk_size):
+    # the peak resident memory of a fresh process that only runs current_ingest, in MB (Linux only)
+    # ru_maxrss would include this process's peak, since it survives the exec
+    code = ("import sys; sys.path.insert(0, {root!r}); import ingest; "
+            "ingest.current_ingest({fname!r}, {id_col!r}, {num_x_grid}, {num_y_grid}, {chunk_size}); "
+            "print([line.split()[1] for line in open('/proc/self/status') if line.startswith('VmHWM')][0])").format(
+        root=os.path.dirname(os.path.abspath(__file__)), fname=fname, id_col=id_col, num_x_grid=num_x_grid,
+        num_y_grid=num_y_grid, chunk_size=chunk_size)
+    # VmHWM is in kilobytes
+    return int(subprocess.check_output([sys.executable, '-c', code])) / 1024.
+
+
+def write_synthetic_polygons(fname, num_areas, seed=0):
+    # small random squares, with a few attribute columns that the layout does not need
+    rng = np.random.RandomState(seed)
+    x = rng.uniform(60, 100, num_areas)
+    y = rng.uniform(5, 35, num_areas)
+    size = rng.uniform(0.01, 0.05, num_areas)
+    gdf = gpd.GeoDataFrame({'id': np.arange(num_areas).astype(str),
+                            'name': ['area {}'.format(i) for i in range(num_areas)],
+                            'population': rng.randint(1000, 1000000, num_areas),
+                            'density': rng.uniform(0, 1000, num_areas)},
+                           geometry=shapely.box(x, y, x + size, y + size), crs='EPSG:4326')
+    gdf.to_file(fname, driver='GeoJSON')
+
+
+def best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--areas', type=int, default=100000, help='number of synthetic polygons')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement; the fastest is reported')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='features per chunk of the chunked ingest')
+    args = parser.parse_args()
+    warnings.filterwarnings('ignore')
+
+    tmpdir = tempfile.mkdtemp()
+    synthetic = os.path.join(tmpdir, 'synthetic.geojson')
+    write_synthetic_polygons(synthetic, args.areas)
+    side = int(np.ceil(np.sqrt(args.areas * 1.5)))
+    cases = [('countries.geo.json', 'sample_data/countries.geo.json', 'name', 30, 20),
+             ('synthetic ({} polygons)'.format(args.areas), synthetic, 'id', side, side)]
+
+    print('{:<28} {:>10} {:>10} {:>8} {:>10} {:>11} {:>11}'.format(
+        'input', 'legacy s', 'current s', 'speedup', 'chunked s', 'current MB', 'chunked MB'))
+    for name, fname, id_col, num_x_grid, num_y_grid in cases:
+        legacy, legacy_df = best_time(lambda: legacy_ingest(fname, num_x_grid, num_y_grid), args.repeat)
+        current, current_df = best_time(lambda: current_ingest(fname, id_col, num_x_grid, num_y_grid), args.repeat)
+        chunked, chunked_df = best_time(lambda: current_ingest(fname, id_col, num_x_grid, num_y_grid, args.chunk_size),
+                                        args.repeat)
+        for df in (current_df, chunked_df):
+            assert (legacy_df['x_bin'].to_numpy() == df['x_bin'].to_numpy()).all()
+            assert (legacy_df['y_bin'].to_numpy() == df['y_bin'].to_numpy()).all()
+        print('{:<28} {:>10.3f} {:>10.3f} {:>7.1f}x {:>10.3f} {:>11.1f} {:>11.1f}'.format(
+            name, legacy, current, legacy / current, chunked,
+            peak_megabytes(fname, id_col, num_x_grid, num_y_grid, None),
+            peak_megabytes(fname, id_col, num_x_grid, num_y_grid, args.chunk_size)))
+    os.remove(synthetic)
+    os.rmdir(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+""" Times each phase of making a cartogram (ingest, binning, layout, SVG render, GeoJSON export) on deterministic
+    synthetic inputs of 100 to 100k areas and on the files in sample_data, and records the peak memory of each phase.
+    Results are written as JSON. Given a baseline written by an earlier run, the suite exits with status 1 when a
+    phase got slower than the baseline by more than the threshold. Run from the repository root:
+
+        python benchmarks/suite.py --output results.json
+        python benchmarks/suite.py --baseline results.json --threshold 0.25 [--sizes 100 1000] [--kinds uniform]
+
+    The default sizes stop at 10k areas; add 100000 to --sizes for the largest inputs, which take minutes per case
+    with the shunt heuristic (and much longer for the city kind).
+
+    Synthetic inputs are laid out on a square grid at --fill, plus one on each of the EDGE_GRIDS below; the sample
+    files on the grids below. Every finished layout is checked to keep each area on the grid and alone in its hex. Dense inputs can
+    make the shunt heuristic cycle, so it gives up after --max-shunts shunts per area and the case is reported as
+    stopped early, without render phases.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from eqcart import Cartogram
+
+PHASES = ('ingest', 'binning', 'layout', 'svg', 'geojson')
+KINDS = ('uniform', 'clustered', 'city')
+SIZES = (100, 1000, 10000)
+# grids one wider than a smaller integer type holds, where bins once wrapped around to negative numbers
+EDGE_GRIDS = [('uniform', 3000, 128, 100)]
+SAMPLES = [('gujarat.json', 'AC_NO', 25, 20), ('himachal.json', 'id', 15, 15), ('in_pollution.csv', 'area', 20, 30),
+           ('europe.geojson', 'ISO3', 12, 10), ('countries.geo.json', 'name', 30, 20)]
+
+
+def synthetic_points(kind, num_areas, seed=0):
+    """ Returns a DataFrame of area, latitude and longitude, the same for the same arguments:
+            uniform: spread evenly over the bounding box
+            clustered: around a handful of regional centres
+            city: mostly packed into a few very dense cities, with a sparse countryside
+    """
+    rng = np.random.RandomState(seed)
+    if kind == 'uniform':
+        lat, lon = rng.uniform(5, 35, num_areas), rng.uniform(65, 95, num_areas)
+    elif kind == 'clustered':
+        centres = rng.uniform([8, 68], [32, 92], (8, 2))
+        which = rng.randint(len(centres), size=num_areas)
+        lat, lon = (centres[which] + rng.normal(0, 2.5, (num_areas, 2))).T
+    elif kind == 'city':
+        centres = rng.uniform([8, 68], [32, 92], (4, 2))
+        in_city = rng.uniform(size=num_areas) < 0.8
+        which = rng.randint(len(centres), size=num_areas)
+        points = np.where(in_city[:, None], centres[which] + rng.normal(0, 0.15, (num_areas, 2)),
+                          rng.uniform([5, 65], [35, 95], (num_areas, 2)))
+        lat, lon = points.T
+    else:
+        raise ValueError("Unknown kind of synthetic input: {}".format(kind))
+    return pd.DataFrame({'area': ['a{}'.format(i) for i in range(num_areas)], 'latitude': lat, 'longitude': lon})
+
+
+def run_phases(fname, id_col, num_x_grid, num_y_grid, method, max_shunts, tmpdir, trace_memory):
+    # runs every phase once, returning the seconds, or the peak bytes allocated if trace_memory, of each phase
+    # when the layout stops early there is nothing to render, and the render phases are left out
+    measures = {}
+    state = {}
+
+    def ingest():
+        state['cart'] = Cartogram(fname, id_col, num_x_grid, num_y_grid)
+
+    def binning():
+        state['cart']._initialize_grid()
+
+    def layout():
+        cart = state['cart']
+        if method == 'shunt':
+            state['finished'] = cart._populate_new_grid(max_shunts=max_shunts * len(cart.df))
+        else:
+            cart._place_new_grid(method)
+            state['finished'] = True
+        if state['finished']:
+            cart._measure_displacement()
+            # every area must be on the grid, and alone in its hex
+            assert cart.df['hex_x'].between(0, cart.num_x_grid).all() and \
+                cart.df['hex_y'].between(0, cart.num_y_grid).all(), "The layout put areas off the grid"
+            assert not cart.df.duplicated(['hex_x', 'hex_y']).any(), "The layout put areas on the same hex"
+
+    def svg():
+        state['cart'].make_hex_svg(os.path.join(tmpdir, 'out.svg'), method='keep')
+
+    def geojson():
+        state['cart'].make_hex_geojson(os.path.join(tmpdir, 'out.geojson'), method='keep')
+
+    for phase, func in zip(PHASES, (ingest, binning, layout, svg, geojson)):
+        if phase in ('svg', 'geojson') and not state['finished']:
+            measures[phase] = None
+            continue
+        if trace_memory:
+            tracemalloc.start()
+            func()
+            measures[phase] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            start = time.perf_counter()
+            func()
+            measures[phase] = time.perf_counter() - start
+    return measures, state
+
+
+def run_case(name, fname, id_col, num_x_grid, num_y_grid, method, max_shunts, repeat, tmpdir):
+    # the fastest of repeat runs per phase; memory is traced in a separate run so that it does not skew the times
+    seconds = {}
+    for _ in range(repeat):
+        times, state = run_phases(fname, id_col, num_x_grid, num_y_grid, method, max_shunts, tmpdir, False)
+        for phase, value in times.items():
+            seconds[phase] = value if value is None else min(value, seconds.get(phase, value))
+    peak_bytes, _ = run_phases(fname, id_col, num_x_grid, num_y_grid, method, max_shunts, tmpdir, True)
+    cart = state['cart']
+    return {'name': name, 'areas': len(cart.df), 'num_x_grid': num_x_grid, 'num_y_grid': num_y_grid,
+            'method': method, 'finished': state['finished'],
+            'total_displacement': float(cart.total_displacement) if state['finished'] else None,
+            'seconds': seconds, 'peak_bytes': peak_bytes}
+
+
+def compare(results, baseline, threshold, min_seconds):
+    # returns a line for every phase that is slower than in the baseline by more than threshold
+    # phases under min_seconds in both runs are too short to time reliably and are skipped
+    previous = {case['name']: case for case in baseline['cases']}
+    regressions = []
+    for case in results['cases']:
+        if case['name'] not in previous:
+            continue
+        for phase in PHASES:
+            old, new = previous[case['name']]['seconds'].get(phase), case['seconds'][phase]
+            if old is None or new is None or max(old, new) < min_seconds:
+                continue
+            if new > old * (1 + threshold):
+                regressions.append('{} {}: {:.4f}s -> {:.4f}s ({:+.0%})'.format(
+                    case['name'], phase, old, new, new / old - 1))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES), help='numbers of synthetic areas')
+    parser.add_argument('--kinds', nargs='+', default=list(KINDS), choices=KINDS, help='kinds of synthetic input')
+    parser.add_argument('--no-samples', action='store_true', help='skip the files in sample_data')
+    parser.add_argument('--method', default='shunt', choices=['shunt', 'nearest', 'assignment'])
+    parser.add_argument('--fill', type=float, default=0.3, help='fraction of the grid filled by synthetic inputs')
+    parser.add_argument('--max-shunts', type=int, default=10, help='shunts per area before the layout gives up')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case; the fastest time of each phase is kept')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='fractional slowdown of a phase against the baseline that counts as a regression')
+    parser.add_argument('--min-seconds', type=float, default=0.01,
+                        help='phases faster than this in both runs are not compared')
+    args = parser.parse_args()
+    warnings.filterwarnings('ignore')
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    tmpdir = tempfile.mkdtemp()
+    cases = []
+    for kind in args.kinds:
+        for num_areas in args.sizes:
+            fname = os.path.join(tmpdir, '{}_{}.csv'.format(kind, num_areas))
+            synthetic_points(kind, num_areas, args.seed).to_csv(fname, index=False)
+            side = int(np.ceil(np.sqrt(num_areas / args.fill)))
+            cases.append(('{}-{}'.format(kind, num_areas), fname, 'area', side, side))
+    for kind, num_areas, num_x_grid, num_y_grid in EDGE_GRIDS:
+        fname = os.path.join(tmpdir, '{}_{}_{}x{}.csv'.format(kind, num_areas, num_x_grid, num_y_grid))
+        synthetic_points(kind, num_areas, args.seed).to_csv(fname, index=False)
+        cases.append(('{}-{}-{}x{}'.format(kind, num_areas, num_x_grid, num_y_grid), fname, 'area', num_x_grid,
+                      num_y_grid))
+    if not args.no_samples:
+        cases += [(fname, os.path.join(root, 'sample_data', fname), id_col, num_x_grid, num_y_grid)
+                  for fname, id_col, num_x_grid, num_y_grid in SAMPLES]
+
+    results = {'python': platform.python_version(), 'platform': platform.platform(), 'method': args.method,
+               'seed': args.seed, 'fill': args.fill, 'max_shunts': args.max_shunts, 'cases': []}
+    print('{:<22} {:>7}'.format('case', 'areas') + ''.join(' {:>9}'.format(phase) for phase in PHASES) +
+          ' {:>10}'.format('peak MB'))
+    try:
+        for name, fname, id_col, num_x_grid, num_y_grid in cases:
+            case = run_case(name, fname, id_col, num_x_grid, num_y_grid, args.method, args.max_shunts,
+                            args.repeat, tmpdir)
+            results['cases'].append(case)
+            print('{:<22} {:>7}'.format(name, case['areas']) +
+                  ''.join(' {:>9}'.format('-' if case['seconds'][phase] is None else
+                                          '{:.4f}'.format(case['seconds'][phase])) for phase in PHASES) +
+                  ' {:>10.1f}'.format(max(peak for peak in case['peak_bytes'].values() if peak is not None) / 1e6) +
+                  ('' if case['finished'] else '  (layout stopped early)'))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_seconds)
+        for line in regressions:
+            print('REGRESSION ' + line)
+        if regressions:
+            sys.exit(1)
+        print('No phase regressed by more than {:.0%} against {}'.format(args.threshold, args.baseline))
+
+
+if __name__ == '__main__':
+    main()
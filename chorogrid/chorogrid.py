@@ -5,7 +5,7 @@
 import re
 import xml.etree.ElementTree as ET
 from math import sqrt
-from IPython.display import SVG, display
+import numpy as np
 import sys
 
 class Chorogrid(object):
@@ -47,10 +47,16 @@ class Chorogrid(object):
         to_return[-1] = to_return[-1][:-1]
         return ''.join(to_return)
 
+    @staticmethod
+    def _escape(text, attrib=True):
+        # escapes text the way ET.tostring does, including its character references for non-ASCII characters
+        text = ET._escape_attrib(text) if attrib else ET._escape_cdata(text)
+        return text.encode('ascii', 'xmlcharrefreplace').decode('ascii')
+
     def _make_svg_top(self, width,
                       height):
-        self.svg = ET.Element('svg', xmlns="http://www.w3.org/2000/svg", version="1.1",
-                              viewbox="0 0 %s %s" % (width, height))
+        self.svg_top = '<svg xmlns="http://www.w3.org/2000/svg" version="1.1" viewbox="{}">\n'.format(
+            self._escape("0 0 %s %s" % (width, height)))
 
     def _determine_font_colors(self, kwargs):
         if 'font_colors' in kwargs.keys():
@@ -76,39 +82,28 @@ class Chorogrid(object):
             return "{},{} {},{} {},{} {},{} {},{} {},{}".format(
                 x, y, x + ww, y, x + ww * 3 / 2, y - hh / 2, x + ww, y - hh, x, y - hh, x - ww / 2, y - hh / 2)
 
-    def done(self, show=False, save_filename=None):
-        svgstring = ET.tostring(self.svg).decode('utf-8')
-        svgstring = svgstring.replace('</svg>', ''.join(self.additional_svg) + '</svg>')
-        svgstring = svgstring.replace(">", ">\n")
-        self.svgstring = svgstring
-        if save_filename is not None:
-            if save_filename[-4:] != '.svg':
-                save_filename += '.svg'
-            if sys.version_info[0] >= 3:
-                with open(save_filename, 'w', encoding='utf-8') as f:
-                    f.write(svgstring)
-            else:
-                with open(save_filename, 'w') as f:
-                    f.write(svgstring.encode('utf-8'))
-        if show is True:
-            display(SVG(svgstring))
+    def _calc_hexagons(self, x, y, w, true_rows):
+        # vectorized _calc_hexagon, returning the six vertices of every hexagon as an (n, 6, 2) array
+        if true_rows:
+            h = w / sqrt(3)
+            xs = [x, x + w / 2, x + w, x + w, x + w / 2, x]
+            ys = [y, y - h / 2, y, y + h, y + 1.5 * h, y + h]
+        else:
+            ww = w / 2
+            hh = w * sqrt(3) / 2
+            xs = [x, x + ww, x + ww * 3 / 2, x + ww, x, x - ww / 2]
+            ys = [y, y, y - hh / 2, y - hh, y - hh, y - hh / 2]
+        return np.stack([np.stack(np.broadcast_arrays(*xs), axis=-1),
+                         np.stack(np.broadcast_arrays(*ys), axis=-1)], axis=-1).astype(float)
 
-    def draw_hex(self, draw_text=False, x_column='hex_x', y_column='hex_y', true_rows=True, **kwargs):
-        font_dict = {'font-style': 'normal', 'font-weight': 'normal', 'font-size': '10px',
-                     'line-height': '125%', 'text-anchor': 'middle', 'font-family': 'sans-serif',
-                     'letter-spacing': '0px', 'word-spacing': '0px', 'fill-opacity': 1,
-                     'stroke': 'none', 'stroke-width': '1px', 'stroke-linecap': 'butt',
-                     'stroke-linejoin': 'miter', 'stroke-opacity': 1}
-        spacing_dict = {'margin_left': 10, 'margin_top': 10, 'margin_right': 10, 'margin_bottom': 10,
-                        'cell_width': 15, 'title_y_offset': 0, 'name_y_offset': 0, 'roundedness': 3,
-                        'stroke_width': 0, 'stroke_color': '#ffffff', 'missing_color': '#a0a0a0',
-                        'gutter': 1, 'missing_font_color': '#000000'}
+    @staticmethod
+    def _default_spacing_dict():
+        return {'margin_left': 10, 'margin_top': 10, 'margin_right': 10, 'margin_bottom': 10,
+                'cell_width': 15, 'title_y_offset': 0, 'name_y_offset': 0, 'roundedness': 3,
+                'stroke_width': 0, 'stroke_color': '#ffffff', 'missing_color': '#a0a0a0',
+                'gutter': 1, 'missing_font_color': '#000000'}
 
-        font_dict = self._update_default_dict(font_dict, 'font_dict', kwargs)
-        spacing_dict = self._update_default_dict(spacing_dict,
-                                                 'spacing_dict', kwargs)
-        font_colors = self._determine_font_colors(kwargs)
-        font_style = self._dict2style(font_dict)
+    def _calc_total_size(self, x_column, y_column, true_rows, spacing_dict):
         if true_rows:
             total_width = (spacing_dict['margin_left'] +
                            (self.df[x_column].max() + 1.5) *
@@ -122,8 +117,6 @@ class Chorogrid(object):
                             (self.df[y_column].max() - 1) *
                             spacing_dict['gutter'] +
                             spacing_dict['margin_bottom'])
-            self.total_width = total_width
-            self.total_height = total_height
         else:
             total_width = (spacing_dict['margin_left'] +
                            (self.df[x_column].max() * 0.75 + 0.25) *
@@ -137,39 +130,119 @@ class Chorogrid(object):
                             (self.df[y_column].max() - 1) *
                             spacing_dict['gutter'] +
                             spacing_dict['margin_bottom'])
-            self.total_width = total_width
-            self.total_height = total_height
-        self._make_svg_top(total_width, total_height)
+        return total_width, total_height
+
+    def _calc_hex_positions(self, x_column, y_column, true_rows, spacing_dict):
+        # vectorized version of the per-cell position arithmetic in draw_hex
         w = spacing_dict['cell_width']
-        for i, id_ in enumerate(self.df[self.id_column]):
-            if id_ in self.ids:
-                this_font_color = font_colors[self.ids.index(id_)]
-            else:
-                this_font_color = spacing_dict['missing_font_color']
-            across = self.df[x_column].iloc[i]
-            down = self.df[y_column].iloc[i]
-            # offset odd rows to the right or down
-            x_offset = 0
-            y_offset = 0
-            if true_rows:
-                if down % 2 == 1:
-                    x_offset = w / 2
-                x = (spacing_dict['margin_left'] +
-                     x_offset + across * (w + spacing_dict['gutter']))
-                y = (spacing_dict['margin_top'] +
-                     down * (1.5 * w / sqrt(3) + spacing_dict['gutter']))
-            else:
-                x_offset = 0.25 * w  # because northwest corner is to the east of westmost point
-                if across % 2 == 1:
-                    y_offset = w * 0.866 / 2
-                x = (spacing_dict['margin_left'] +
-                     x_offset + across * 0.75 * (w + spacing_dict['gutter']))
-                y = (spacing_dict['margin_top'] +
-                     y_offset + down * (sqrt(3) / 2 * w + spacing_dict['gutter']))
-
-            this_font_style = font_style + ';fill:{}'.format(this_font_color)
-            ET.SubElement(self.svg, "polygon", id=id_, points=self._calc_hexagon(x, y, w, true_rows))
+        across = self.df[x_column].to_numpy()
+        down = self.df[y_column].to_numpy()
+        # offset odd rows to the right or down
+        if true_rows:
+            x_offset = np.where(down % 2 == 1, w / 2, 0)
+            x = (spacing_dict['margin_left'] +
+                 x_offset + across * (w + spacing_dict['gutter']))
+            y = (spacing_dict['margin_top'] +
+                 down * (1.5 * w / sqrt(3) + spacing_dict['gutter']))
+        else:
+            x_offset = 0.25 * w  # because northwest corner is to the east of westmost point
+            y_offset = np.where(across % 2 == 1, w * 0.866 / 2, 0)
+            x = (spacing_dict['margin_left'] +
+                 x_offset + across * 0.75 * (w + spacing_dict['gutter']))
+            y = (spacing_dict['margin_top'] +
+                 y_offset + down * (sqrt(3) / 2 * w + spacing_dict['gutter']))
+        return x, y
+
+    def hex_vertices(self, x_column='hex_x', y_column='hex_y', true_rows=True, **kwargs):
+        """ Returns the vertices of every hexagon draw_hex would draw, in SVG coordinates, as an (n, 6, 2) array
+            in the row order of df. Takes the same true_rows and spacing_dict options as draw_hex.
+        """
+        spacing_dict = self._update_default_dict(self._default_spacing_dict(), 'spacing_dict', kwargs)
+        self.total_width, self.total_height = self._calc_total_size(x_column, y_column, true_rows, spacing_dict)
+        x, y = self._calc_hex_positions(x_column, y_column, true_rows, spacing_dict)
+        return self._calc_hexagons(x, y, spacing_dict['cell_width'], true_rows)
+
+    def _iter_svg(self, fills=None):
+        # yields the document piece by piece, formatted exactly as ET.tostring followed by a newline after every tag
+        # fills, if given, are the already escaped fill colors of the hexagons in the row order of df
+        yield self.svg_top
+        ids, xs, ys, font_colors, w, true_rows, draw_text, font_style, name_y_offset = self.cells
+        for i, (id_, x, y, font_color) in enumerate(zip(ids, xs, ys, font_colors)):
+            style = '' if fills is None else ' style="fill:{}"'.format(fills[i])
+            yield '<polygon id="{}" points="{}"{} />\n'.format(
+                self._escape(id_), self._calc_hexagon(x, y, w, true_rows), style)
             if draw_text:
-                _ = ET.SubElement(self.svg, "text", id="text{}".format(id_), x=str(x + w / 2),
-                                  y=str(y + spacing_dict['name_y_offset']), style=this_font_style)
-                _.text = str(id_)
+                text = '<text id="{}" x="{}" y="{}" style="{}"'.format(
+                    self._escape("text{}".format(id_)), x + w / 2, y + name_y_offset,
+                    self._escape(font_style + ';fill:{}'.format(font_color)))
+                yield text + ('>\n{}</text>\n'.format(self._escape(str(id_), attrib=False)) if str(id_) else ' />\n')
+        for svg in self.additional_svg:
+            yield svg.replace(">", ">\n")
+        yield '</svg>\n'
+
+    def fill_template(self):
+        """ Returns the document draw_hex made as a list of len(df) + 1 strings. Joining them with the escaped fill
+            color of every hexagon in between, in the row order of df, gives the document with filled hexagons.
+        """
+        # NUL cannot appear in an SVG, so it marks where the fills go
+        parts = ''.join(self._iter_svg(fills=['\0'] * len(self.cells[0]))).split('\0')
+        assert len(parts) == len(self.cells[0]) + 1, "An id contains a NUL character"
+        return parts
+
+    @property
+    def svgstring(self):
+        return ''.join(self._iter_svg())
+
+    def write_svg(self, f):
+        """ Writes the SVG to a file-like object piece by piece, without holding the whole document in memory """
+        for fragment in self._iter_svg():
+            f.write(fragment)
+
+    def done(self, show=False, save_filename=None):
+        if save_filename is not None:
+            if save_filename[-4:] != '.svg':
+                save_filename += '.svg'
+            if sys.version_info[0] >= 3:
+                with open(save_filename, 'w', encoding='utf-8') as f:
+                    self.write_svg(f)
+            else:
+                with open(save_filename, 'w') as f:
+                    self.write_svg(f)
+        if show is True:
+            # IPython is only needed, and only imported, to show the result in a notebook
+            from IPython.display import SVG, display
+            display(SVG(self.svgstring))
+
+    def draw_hex(self, draw_text=False, x_column='hex_x', y_column='hex_y', true_rows=True, **kwargs):
+        font_dict = {'font-style': 'normal', 'font-weight': 'normal', 'font-size': '10px',
+                     'line-height': '125%', 'text-anchor': 'middle', 'font-family': 'sans-serif',
+                     'letter-spacing': '0px', 'word-spacing': '0px', 'fill-opacity': 1,
+                     'stroke': 'none', 'stroke-width': '1px', 'stroke-linecap': 'butt',
+                     'stroke-linejoin': 'miter', 'stroke-opacity': 1}
+        spacing_dict = self._default_spacing_dict()
+
+        font_dict = self._update_default_dict(font_dict, 'font_dict', kwargs)
+        spacing_dict = self._update_default_dict(spacing_dict,
+                                                 'spacing_dict', kwargs)
+        font_colors = self._determine_font_colors(kwargs)
+        font_style = self._dict2style(font_dict)
+        total_width, total_height = self._calc_total_size(x_column, y_column, true_rows, spacing_dict)
+        self.total_width = total_width
+        self.total_height = total_height
+        self._make_svg_top(total_width, total_height)
+        w = spacing_dict['cell_width']
+
+        # the first occurrence of an id decides its font color
+        font_color_by_id = {}
+        for id_, font_color in zip(self.ids, font_colors):
+            font_color_by_id.setdefault(id_, font_color)
+        ids = self.df[self.id_column].tolist()
+        font_colors = [font_color_by_id.get(id_, spacing_dict['missing_font_color']) for id_ in ids]
+
+        x, y = self._calc_hex_positions(x_column, y_column, true_rows, spacing_dict)
+        x, y = x.tolist(), y.tolist()
+        if true_rows and np.issubdtype(self.df[x_column].dtype, np.integer) and all(
+                isinstance(spacing_dict[k], (int, np.integer)) for k in ('margin_left', 'cell_width', 'gutter')):
+            # on rows without an offset x is a whole number, which is formatted without a decimal point
+            x = [int(x_) if down % 2 != 1 else x_ for x_, down in zip(x, self.df[y_column].tolist())]
+        self.cells = (ids, x, y, font_colors, w, true_rows, draw_text, font_style, spacing_dict['name_y_offset'])
@@ -1 +1,4 @@
-from .eqcart import Cartogram
\ No newline at end of file
+from .eqcart import Cartogram
+from .cache import LayoutCache
+from .stats import LayoutStats
+from .frames import FrameRenderer
@@ -0,0 +1,106 @@
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+
+class LayoutCache(object):
+    """ A cache of computed hexgrid layouts, instantiated with:
+            directory: where layouts are stored on disk, or None to only keep them in memory
+            max_bytes: the most disk space the stored layouts may use; the least recently used are evicted first
+            memo_size: how many layouts are also kept in memory in this process
+
+        Layouts are stored as .npy files holding a (2, n) array of hex_x and hex_y, which are memory-mapped when read.
+        hits and misses count lookups since the cache was created.
+    """
+
+    def __init__(self, directory=None, max_bytes=256 * 1024 * 1024, memo_size=32):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memo_size = memo_size
+        self.hits = 0
+        self.misses = 0
+        self._memo = OrderedDict()
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, ids, longitudes, latitudes, num_x_grid, num_y_grid, method, version):
+        # hashes everything the layout depends on
+        digest = hashlib.sha1()
+        digest.update("{}|{}|{}|{}|{}|".format(len(ids), num_x_grid, num_y_grid, method, version).encode('utf-8'))
+        digest.update("\0".join(str(id_) for id_ in ids).encode('utf-8'))
+        digest.update(np.ascontiguousarray(longitudes, dtype='<f8').tobytes())
+        digest.update(np.ascontiguousarray(latitudes, dtype='<f8').tobytes())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npy")
+
+    def _remember(self, key, layout):
+        self._memo[key] = layout
+        self._memo.move_to_end(key)
+        while len(self._memo) > self.memo_size:
+            self._memo.popitem(last=False)
+
+    def get(self, key):
+        # returns (hex_x, hex_y) for the key, or None if it has not been stored
+        if key in self._memo:
+            self._memo.move_to_end(key)
+            self.hits += 1
+            return self._memo[key]
+        if self.directory is not None and os.path.exists(self._path(key)):
+            try:
+                layout = np.load(self._path(key), mmap_mode='r')
+                # reading a layout makes it the most recently used
+                os.utime(self._path(key), None)
+            except (IOError, OSError, ValueError):
+                layout = None
+            if layout is not None:
+                self._remember(key, (layout[0], layout[1]))
+                self.hits += 1
+                return self._memo[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, hex_x, hex_y):
+        # the smallest signed integer type that holds the largest hex; min_scalar_type(-n) only holds values below n
+        layout = np.array([hex_x, hex_y], dtype=np.min_scalar_type(-(max(np.max(hex_x), np.max(hex_y), 1) + 1)))
+        self._remember(key, (layout[0], layout[1]))
+        if self.directory is None:
+            return
+        # written to a temporary file and renamed, so other processes never read a partial layout
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, layout)
+        os.replace(tmp_path, self._path(key))
+        self._evict()
+
+    def _evict(self):
+        # removes the least recently used layouts until the directory fits in max_bytes
+        # other processes may be evicting from the same directory, so files can vanish at any point
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npy"):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        self._memo.clear()
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith(".npy"):
+                    os.remove(os.path.join(self.directory, name))
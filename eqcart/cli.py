@@ -0,0 +1,190 @@
+""" Command-line entry point, installed as `eqcart`.
+
+    eqcart render INPUT ID_COL NUM_X_GRID NUM_Y_GRID --svg OUT.svg --geojson OUT.geojson
+    eqcart batch MANIFEST.json --workers 8
+
+    A batch manifest is a JSON list of jobs such as
+        {"input": "sample_data/gujarat.json", "id_col": "AC_NO", "num_x_grid": 25, "num_y_grid": 20,
+         "output": "out/gujarat", "formats": ["svg", "geojson"]}
+    where formats may include svg, geojson, geojsonl (newline-delimited GeoJSON), topojson, and parquet or arrow (the
+    layout table of make_hex_table). Instead of output and formats, a job may give the path of each output under its
+    format, e.g. {"svg": "out/gujarat_map.svg", ...}. The optional keys method and draw_text are passed on to
+    make_hex_svg/make_hex_geojson, and chunk_size to Cartogram. With parent_col, the job is laid out with
+    hierarchical_layout, one block per parent region, using layout_workers processes (1 by default, since a batch
+    already runs jobs in parallel). Relative paths are resolved against the manifest's directory.
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import sys
+import time
+import traceback
+
+from .cache import LayoutCache
+from .eqcart import Cartogram
+
+FORMATS = {"svg": ".svg", "geojson": ".geojson", "geojsonl": ".geojsonl", "topojson": ".topojson",
+           "parquet": ".parquet", "arrow": ".arrow"}
+
+
+def job_outputs(job):
+    # returns (format, path) for every output of a manifest entry
+    outputs = [(fmt, job[fmt]) for fmt in FORMATS if fmt in job]
+    if "output" in job:
+        formats = job.get("formats", ["svg"])
+        unknown = set(formats).difference(FORMATS)
+        assert not unknown, "Unknown output formats: {}".format(", ".join(sorted(unknown)))
+        outputs += [(fmt, job["output"] + FORMATS[fmt]) for fmt in formats]
+    assert outputs, "The job has no outputs"
+    return outputs
+
+
+def run_job(job, cache_dir=None):
+    # runs one manifest entry, returning a summary instead of raising so one bad input cannot abort a batch
+    start = time.time()
+    summary = {"input": job.get("input"), "status": "ok", "seconds": None, "outputs": [], "error": None,
+               "stats": None}
+    try:
+        outputs = job_outputs(job)
+        cache = LayoutCache(cache_dir) if cache_dir is not None else None
+        # Chorogrid prints id mismatches; they would interleave between workers, so they are dropped here
+        with contextlib.redirect_stdout(io.StringIO()):
+            cart = Cartogram(job["input"], job["id_col"], int(job["num_x_grid"]), int(job["num_y_grid"]), cache=cache,
+                             chunk_size=job.get("chunk_size"), parent_col=job.get("parent_col"))
+            method = job.get("method", "shunt")
+            if job.get("parent_col") is not None:
+                cart.hierarchical_layout(method, workers=job.get("layout_workers", 1))
+                method = "keep"
+            for fmt, output_fname in outputs:
+                if fmt == "svg":
+                    cart.make_hex_svg(output_fname, draw_text=job.get("draw_text", False), method=method)
+                elif fmt == "topojson":
+                    cart.make_hex_topojson(output_fname, method=method)
+                elif fmt in ("parquet", "arrow"):
+                    cart.make_hex_table(output_fname, method=method)
+                else:
+                    cart.make_hex_geojson(output_fname, method=method, newline_delimited=(fmt == "geojsonl"))
+                summary["outputs"].append(output_fname)
+            summary["stats"] = cart.stats.as_dict()
+    except Exception as e:
+        summary["status"] = "failed"
+        summary["error"] = "{}: {}".format(type(e).__name__, e)
+        summary["traceback"] = traceback.format_exc()
+    summary["seconds"] = round(time.time() - start, 3)
+    return summary
+
+
+def read_manifest(fname):
+    with open(fname) as f:
+        jobs = json.load(f)
+    assert isinstance(jobs, list), "The manifest must be a JSON list of jobs"
+    base = os.path.dirname(os.path.abspath(fname))
+    for job in jobs:
+        for key in ("input", "output") + tuple(FORMATS):
+            if key in job and not os.path.isabs(job[key]):
+                job[key] = os.path.join(base, job[key])
+    return jobs
+
+
+def _run_job_process(connection, job, cache_dir):
+    # the body of a batch job's worker process, which sends the summary back to run_batch
+    connection.send(run_job(job, cache_dir))
+    connection.close()
+
+
+def run_batch(jobs, workers=None, cache_dir=None):
+    """ Runs every job in its own worker process, at most workers at a time, and returns their summaries, in manifest
+        order. A worker that dies, e.g. because GDAL crashed or it ran out of memory, only fails its own job.
+    """
+    workers = workers or os.cpu_count() or 1
+    summaries = [None] * len(jobs)
+    waiting = list(enumerate(jobs))[::-1]
+    running = {}
+    while waiting or running:
+        while waiting and len(running) < workers:
+            i, job = waiting.pop()
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=_run_job_process, args=(sender, job, cache_dir))
+            process.start()
+            # only the worker holds the sending end now, so the receiver sees the end of the pipe if the worker dies
+            sender.close()
+            running[receiver] = (i, process)
+        for receiver in multiprocessing.connection.wait(list(running)):
+            i, process = running.pop(receiver)
+            try:
+                summaries[i] = receiver.recv()
+            except EOFError:
+                process.join()
+                summaries[i] = {"input": jobs[i].get("input"), "status": "failed", "seconds": None, "outputs": [],
+                                "error": "the worker process exited with code {}".format(process.exitcode),
+                                "stats": None}
+            receiver.close()
+            process.join()
+    return summaries
+
+
+def print_summary(summaries, wall_time, out=sys.stdout):
+    for summary in summaries:
+        seconds = "-" if summary["seconds"] is None else "{:.3f}s".format(summary["seconds"])
+        out.write("{:<7} {:>9}  {}{}\n".format(summary["status"], seconds, summary["input"],
+                                                "  ({})".format(summary["error"]) if summary["error"] else ""))
+    failed = sum(summary["status"] != "ok" for summary in summaries)
+    out.write("{} jobs, {} failed, {:.3f}s wall time\n".format(len(summaries), failed, wall_time))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="eqcart", description="Make equal area hexgrid cartograms")
+    parser.add_argument("--cache-dir", help="directory of a LayoutCache shared by all jobs")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    render = subparsers.add_parser("render", help="make a cartogram from one input file")
+    render.add_argument("input")
+    render.add_argument("id_col")
+    render.add_argument("num_x_grid", type=int)
+    render.add_argument("num_y_grid", type=int)
+    render.add_argument("--svg", help="SVG output path")
+    render.add_argument("--geojson", help="GeoJSON output path")
+    render.add_argument("--geojsonl", help="newline-delimited GeoJSON output path")
+    render.add_argument("--topojson", help="TopoJSON output path")
+    render.add_argument("--parquet", help="Parquet layout table output path")
+    render.add_argument("--arrow", help="Arrow (Feather) layout table output path")
+    render.add_argument("--method", default="shunt", choices=["shunt", "nearest", "assignment"])
+    render.add_argument("--draw-text", action="store_true")
+    render.add_argument("--chunk-size", type=int, help="read a geometry input this many features at a time")
+    render.add_argument("--parent-col", help="lay out the areas of each parent region on its own block of the grid")
+    render.add_argument("--layout-workers", type=int, default=None,
+                        help="processes laying out the blocks of --parent-col (default: one per core)")
+
+    batch = subparsers.add_parser("batch", help="run every job in a JSON manifest in parallel")
+    batch.add_argument("manifest")
+    batch.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    batch.add_argument("--summary", help="also write the per-job summary to this JSON file")
+
+    args = parser.parse_args(argv)
+    if args.command == "render":
+        job = {"input": args.input, "id_col": args.id_col, "num_x_grid": args.num_x_grid,
+               "num_y_grid": args.num_y_grid, "method": args.method, "draw_text": args.draw_text,
+               "chunk_size": args.chunk_size, "parent_col": args.parent_col, "layout_workers": args.layout_workers}
+        job.update((fmt, getattr(args, fmt)) for fmt in FORMATS if getattr(args, fmt))
+        if not any(fmt in job for fmt in FORMATS):
+            parser.error("give at least one of --svg, --geojson, --geojsonl, --topojson, --parquet or --arrow")
+        start = time.time()
+        summaries = [run_job(job, args.cache_dir)]
+    else:
+        jobs = read_manifest(args.manifest)
+        start = time.time()
+        summaries = run_batch(jobs, workers=args.workers, cache_dir=args.cache_dir)
+    print_summary(summaries, time.time() - start)
+    if args.command == "batch" and args.summary:
+        with open(args.summary, "w") as f:
+            json.dump(summaries, f, indent=2)
+    return 1 if any(summary["status"] != "ok" for summary in summaries) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
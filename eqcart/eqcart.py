@@ -1,9 +1,157 @@
-import geopandas as gpd
 import pandas as pd
+import numpy as np
 from chorogrid import Chorogrid
-from bs4 import BeautifulSoup
+from .stats import LayoutStats
+from .frames import FrameRenderer
 import json
+import heapq
 import os
+import copy
+import contextlib
+import functools
+import concurrent.futures
+
+# bump whenever a layout method changes its output, so cached layouts from older versions are not reused
+LAYOUT_VERSION = 2
+
+# axial (q, r) steps to the six neighbours of a hex, in the order they are walked around a ring
+_HEX_DIRECTIONS = ((1, 0), (1, -1), (0, -1), (-1, 0), (-1, 1), (0, 1))
+
+
+@functools.lru_cache(maxsize=None)
+def _hex_disc(radius):
+    # axial offsets (q, r) of the hexes within `radius` steps of a hex, ring by ring outwards, and the ring of each
+    q, r, ring = [0], [0], [0]
+    for step in range(1, radius + 1):
+        # walk around the ring, starting from the hex `step` steps in the last direction
+        hex_q, hex_r = -step, step
+        for dq, dr in _HEX_DIRECTIONS:
+            for _ in range(step):
+                q.append(hex_q)
+                r.append(hex_r)
+                ring.append(step)
+                hex_q, hex_r = hex_q + dq, hex_r + dr
+    return np.array(q, dtype=np.int64), np.array(r, dtype=np.int64), np.array(ring, dtype=np.int64)
+
+
+def _hex_distance(x0, y0, x1, y1):
+    # steps between hexes at bins (x0, y0) and (x1, y1), laid out as Chorogrid.draw_hex does with odd rows shifted
+    # right by half a hex; bins are converted to axial coordinates q = x - (y - y % 2) / 2, r = y
+    dr = y1 - y0
+    dq = (x1 - (y1 - (y1 & 1)) // 2) - (x0 - (y0 - (y0 & 1)) // 2)
+    return (abs(dq) + abs(dr) + abs(dq + dr)) // 2
+
+
+def _check_output_directory(output_fname):
+    # raises IOError if the directory output_fname would be written to does not exist
+    directory = os.path.dirname(output_fname)
+    if directory and not os.path.isdir(directory):
+        raise IOError('The directory specified does not exist')
+
+
+def _grid_score(num_areas, num_x_grid, num_y_grid, mean_displacement, max_displacement, cascades, sparsity_weight):
+    # scores a layout for Cartogram.auto_grid_size; lower is better
+    # displacements are measured in units of the typical distance between neighbouring areas on the grid
+    num_cells = (num_x_grid + 1) * (num_y_grid + 1)
+    spacing = np.sqrt(num_cells / float(num_areas))
+    return ((mean_displacement + 0.1 * max_displacement) / spacing + cascades / float(num_areas) +
+            sparsity_weight * (1 - num_areas / float(num_cells)))
+
+
+def _score_grid_size(cart, num_x_grid, num_y_grid, method, sparsity_weight, max_cascades):
+    # lays cart out on one candidate grid and scores it; run in worker processes by Cartogram.auto_grid_size
+    cart.num_x_grid, cart.num_y_grid = num_x_grid, num_y_grid
+    cart._initialize_grid()
+    num_areas = len(cart.df)
+    if method == "shunt":
+        # some grids make the shunt heuristic cycle forever, so the number of shunts is capped too
+        finished = cart._populate_new_grid(max_shunts=50 * num_areas, max_cascades=max_cascades)
+        cascades = cart.num_cascades
+    else:
+        cart._place_new_grid(method)
+        finished, cascades = True, 0
+    result = {"num_x_grid": num_x_grid, "num_y_grid": num_y_grid, "finished": finished, "cascades": cascades,
+              "mean_displacement": None, "max_displacement": None, "score": None}
+    if finished:
+        cart._measure_displacement()
+        result["mean_displacement"] = cart.total_displacement / num_areas
+        result["max_displacement"] = cart.max_displacement
+        result["score"] = _grid_score(num_areas, num_x_grid, num_y_grid, result["mean_displacement"],
+                                      cart.max_displacement, cascades, sparsity_weight)
+    return result
+
+
+def _split_blocks(regions, x0, y0, width, height, max_fill, attempts):
+    # gives every region in regions, a list of (parent, num_areas, x_bin, y_bin) with the mean bin of its areas, a block
+    # of the width by height bins from (x0, y0), returning parent -> (x0, y0, width, height), or None if they do not fit
+    # the block is cut in two between the regions on either side of the cut, where the two sides meet on the grid; the
+    # most even cut by number of areas that leaves no more than max_fill of either half's bins taken is tried first
+    # attempts is a one-item list counting down the cuts that may still be tried, so a grid that is too small fails fast
+    if len(regions) == 1:
+        return {regions[0][0]: (x0, y0, width, height)} if regions[0][1] <= width * height else None
+    total = sum(region[1] for region in regions)
+    candidates = {}
+    # cuts that fill a half up to the last bin, then cuts across the shorter side, are only tried after the others
+    for fill_rank, fill in enumerate(sorted(set([max_fill, 1.]))):
+        for axis_rank, axis in enumerate((0, 1) if width >= height else (1, 0)):
+            length, breadth = (width, height) if axis == 0 else (height, width)
+            ordered = sorted(regions, key=lambda region: region[2 + axis])
+            first = 0
+            for k in range(1, len(ordered)):
+                first += ordered[k - 1][1]
+                min_cut = int(np.ceil(first / (breadth * fill)))
+                max_cut = length - int(np.ceil((total - first) / (breadth * fill)))
+                if min_cut > max_cut:
+                    continue
+                boundary = (ordered[k - 1][2 + axis] + ordered[k][2 + axis]) / 2. + 0.5 - (x0, y0)[axis]
+                cut = min(max(int(round(boundary)), min_cut), max_cut)
+                rank = (fill_rank, axis_rank, abs(first - total / 2.))
+                key = (axis, k, cut)
+                if key not in candidates or rank < candidates[key][0]:
+                    candidates[key] = (rank, ordered)
+    for (axis, k, cut), (_, ordered) in sorted(candidates.items(), key=lambda item: item[1][0]):
+        if attempts[0] <= 0:
+            return None
+        attempts[0] -= 1
+        if axis == 0:
+            halves = [(ordered[:k], x0, y0, cut, height), (ordered[k:], x0 + cut, y0, width - cut, height)]
+        else:
+            halves = [(ordered[:k], x0, y0, width, cut), (ordered[k:], x0, y0 + cut, width, height - cut)]
+        blocks = {}
+        for half in halves:
+            half_blocks = _split_blocks(*half, max_fill=max_fill, attempts=attempts)
+            if half_blocks is None:
+                break
+            blocks.update(half_blocks)
+        else:
+            return blocks
+    return None
+
+
+def _layout_block(cart, width, height, method):
+    # lays cart, holding the areas of one parent region with their bins relative to the region's width by height
+    # block, out on that block; run in worker processes by Cartogram.hierarchical_layout
+    cart.num_x_grid, cart.num_y_grid = width - 1, height - 1
+    for column, size in (('x_bin', width), ('y_bin', height)):
+        # the region's bins are moved as little as possible to fit in the block, and squeezed only if they span more
+        # of the grid than the block does, so areas outside it do not all pile up along its edge
+        bins = cart.df[column].to_numpy(dtype=float)
+        low, span = bins.min(), bins.max() - bins.min()
+        scale = min(1., (size - 1) / span) if span else 1.
+        shift = min(max(low, 0.), size - 1 - span * scale)
+        cart.df[column] = np.rint((bins - low) * scale + shift).astype(np.int64)
+    cart._reset_counters()
+    if method == "shunt":
+        # a block can be nearly full, which may make the shunt heuristic cycle, so it falls back to "nearest"
+        if not cart._populate_new_grid(max_shunts=50 * len(cart.df)):
+            cart.num_cascades = cart.num_cascade_moves = 0
+            cart._hex_new_grid()
+    else:
+        cart._place_new_grid(method)
+    return {"hex_x": cart.df['hex_x'].to_numpy(), "hex_y": cart.df['hex_y'].to_numpy(),
+            "num_shunts": cart.num_shunts, "num_neighbour_moves": cart.num_neighbour_moves,
+            "num_cascades": cart.num_cascades, "num_cascade_moves": cart.num_cascade_moves}
+
 
 class Cartogram(object):
     """ An object which makes equal-area hexgrid cartograms, instantiated with:
@@ -11,6 +159,19 @@ class Cartogram(object):
             id_col: a unique attribute/column in the input file that will be used as the id of an SVG
             num_x_grid: the width of the hexgrid
             num_y_grid: the height of the hexgrid
+                (if either is left out, both are chosen by auto_grid_size the first time a layout is made)
+            cache: an optional LayoutCache, so repeated layouts of the same input are not recomputed
+            trace_memory: whether stats should also record the peak memory of each phase (slow)
+            progress: an optional function called with stats every progress_every shunts of the shunt heuristic,
+                and at the end of every layout
+            chunk_size: if given, a geojson or shp input is read this many features at a time, and only the id and
+                centroid of every area are kept, so files too large to load whole can be used (needs pyogrio and
+                pyarrow)
+            parent_col: an optional column holding the parent region of every area (e.g. the state of a district),
+                which hierarchical_layout lays out region by region
+
+        After a layout, total_displacement and max_displacement hold how far (in bins) areas were moved, and stats
+        (a LayoutStats) holds the time each phase took and what the layout did
 
         Methods (introspect to see arguments)
            make_hex_svg: make choropleth
@@ -19,21 +180,32 @@ class Cartogram(object):
            done_with_overlay: overlay two Chorogrid objects
     """
 
-    def __init__(self, input_fname, id_col, num_x_grid, num_y_grid):
-        self.df = self.read_file(input_fname)
-        assert id_col in self.df.columns, ("{} is not a column in {}".format(id_col, input_fname))
+    def __init__(self, input_fname, id_col, num_x_grid=None, num_y_grid=None, cache=None, trace_memory=False,
+                 progress=None, progress_every=1000, chunk_size=None, parent_col=None):
+        assert progress_every >= 1, "progress_every must be at least 1"
+        self.stats = LayoutStats(trace_memory)
+        self.progress = progress
+        self.progress_every = progress_every
+        with self.stats.phase("ingest"):
+            if chunk_size is not None and not input_fname.endswith((".csv", ".xls", ".xlsx")):
+                self.df = self._read_centroids(input_fname, id_col, chunk_size, parent_col)
+            else:
+                columns = [id_col, "latitude", "longitude"] + ([] if parent_col is None else [parent_col])
+                self.df = self.read_file(input_fname, columns=columns)
+            assert id_col in self.df.columns, ("{} is not a column in {}".format(id_col, input_fname))
+            assert parent_col is None or parent_col in self.df.columns, (
+                "{} is not a column in {}".format(parent_col, input_fname))
+            if "latitude" not in self.df.columns or "longitude" not in self.df.columns:
+                import shapely
+                centroids = shapely.centroid(self.df['geometry'].to_numpy())
+                self.df['longitude'] = shapely.get_x(centroids)
+                self.df['latitude'] = shapely.get_y(centroids)
         self.index_col = id_col
+        self.parent_col = parent_col
         self.num_x_grid = num_x_grid
         self.num_y_grid = num_y_grid
-        self.coord_points = {}
-        self.x_coords_points = {}
-        self.y_coords_points = {}
-        self.point_position = {}
-
-        if "latitude" not in self.df.columns or "longitude" not in self.df.columns:
-            self.df['centroid'] = self.df['geometry'].apply(lambda x: x.centroid)
-            self.df['longitude'] = self.df['centroid'].apply(lambda x: x.coords.xy[0][0])
-            self.df['latitude'] = self.df['centroid'].apply(lambda x: x.coords.xy[1][0])
+        self.cache = cache
+
         self.max_longitude = self.df['longitude'].max()
         self.max_latitude = self.df['latitude'].max()
         self.min_longitude = self.df['longitude'].min()
@@ -43,197 +215,779 @@ class Cartogram(object):
     def _initialize_grid(self):
         # initializes the grid
         assert (self.num_x_grid * self.num_y_grid) > self.df.shape[0], "Too few dimensions"
+        self.df["x_bin"], self.df["y_bin"] = self._calc_bins(self.num_x_grid, self.num_y_grid)
+
+    def _calc_bins(self, num_x_grid, num_y_grid):
+        # the bin of every point on a num_x_grid by num_y_grid grid
         xmax, xmin = self.df['longitude'].max(), self.df['longitude'].min()
         ymax, ymin = self.df['latitude'].max(), self.df['latitude'].min()
         x_range = xmax - xmin
         y_range = ymax - ymin
 
-        self.df["x_bin"] = self.df["longitude"].apply(lambda x: int(self.num_x_grid * (x - xmin) / x_range))
-        self.df["y_bin"] = self.df["latitude"].apply(lambda y: int(self.num_y_grid * (ymax - y) / y_range))
+        # bins run from 0 to the grid dimensions inclusive, so the smallest signed integer type that holds one more than
+        # the largest of them is enough (min_scalar_type(-128) is int8, which cannot hold 128)
+        dtype = np.min_scalar_type(-(max(num_x_grid, num_y_grid) + 1))
+        x_bins = (num_x_grid * (self.df["longitude"].to_numpy() - xmin) / x_range).astype(dtype)
+        y_bins = (num_y_grid * (ymax - self.df["latitude"].to_numpy()) / y_range).astype(dtype)
+        return x_bins, y_bins
 
-    def read_file(self, fname):
+    def read_file(self, fname, columns=None):
+        # reads the input file; if columns is given, only those of them that exist (plus any geometry) are loaded
+        usecols = None if columns is None else (lambda col: col in columns)
         if fname.endswith(".csv"):
-            df = pd.read_csv(fname)
+            df = pd.read_csv(fname, usecols=usecols)
         elif fname.endswith(".xls") or fname.endswith(".xlsx"):
-            df = pd.read_excel(fname)
+            df = pd.read_excel(fname, usecols=usecols)
         else:
+            # geopandas takes a while to import, so CSV and Excel inputs do without it
+            try:
+                import geopandas as gpd
+            except ImportError:
+                raise ImportError("Reading {} requires geopandas to be installed".format(fname))
             try:
-                df = gpd.read_file(fname)
+                df = gpd.read_file(fname, columns=columns)
             except Exception as e:
                 raise Exception(e)
         return df
 
+    def _read_centroids(self, fname, id_col, chunk_size, parent_col=None):
+        # streams the id and centroid of every feature of a geometry file, chunk_size features at a time, so that no
+        # more than chunk_size geometries are in memory at once; features that have latitude and longitude keep them
+        try:
+            import pyogrio
+            import pyarrow
+            import shapely
+        except ImportError:
+            raise ImportError("chunk_size requires pyogrio, pyarrow and shapely to be installed")
+        fields = list(pyogrio.read_info(fname)['fields'])
+        assert id_col in fields, ("{} is not a column in {}".format(id_col, fname))
+        has_coordinates = "latitude" in fields and "longitude" in fields
+        columns = [id_col] if parent_col is None else [id_col, parent_col]
+        if has_coordinates:
+            columns += ["longitude", "latitude"]
+
+        ids, parents, longitudes, latitudes = [], [], [], []
+        with pyogrio.open_arrow(fname, columns=columns, read_geometry=not has_coordinates, batch_size=chunk_size,
+                                use_pyarrow=True) as (meta, reader):
+            for batch in reader:
+                ids.append(batch.column(id_col).to_numpy(zero_copy_only=False))
+                if parent_col is not None:
+                    parents.append(batch.column(parent_col).to_numpy(zero_copy_only=False))
+                if has_coordinates:
+                    longitudes.append(batch.column("longitude").to_numpy(zero_copy_only=False).astype(float))
+                    latitudes.append(batch.column("latitude").to_numpy(zero_copy_only=False).astype(float))
+                else:
+                    geometry = batch.column(meta['geometry_name'] or "wkb_geometry")
+                    centroids = shapely.centroid(shapely.from_wkb(geometry.to_numpy(zero_copy_only=False)))
+                    longitudes.append(shapely.get_x(centroids))
+                    latitudes.append(shapely.get_y(centroids))
+        if not ids:
+            df = pd.DataFrame({id_col: [], "longitude": [], "latitude": []})
+        else:
+            df = pd.DataFrame({id_col: np.concatenate(ids), "longitude": np.concatenate(longitudes),
+                               "latitude": np.concatenate(latitudes)})
+        if parent_col is not None:
+            df.insert(1, parent_col, np.concatenate(parents) if parents else [])
+        return df
+
     def _is_valid(self):
         # checks is any square in the grid has more than 1 point assigned to it
-        for coord in self.coord_points:
-            if len(self.coord_points[coord]) > 1:
-                return False
-        return True
+        return self._num_overfull == 0
 
     def _delete_old_point(self, x, y, ac_to_shunt):
         # deletes a point from the grid
-        self.coord_points[str(x) + "_" + str(y)].remove(ac_to_shunt)
-        self.x_coords_points[x].remove(ac_to_shunt)
-        self.y_coords_points[y].remove(ac_to_shunt)
+        cell = y * (self.num_x_grid + 1) + x
+        self._cell_points[cell].remove(ac_to_shunt)
+        self._cell_counts[cell] -= 1
+        count = self._cell_counts[cell]
+        if count == 1:
+            self._num_overfull -= 1
+        elif count > 1:
+            heapq.heappush(self._overfull, (-count, self._cell_rank[cell], cell))
 
     def _update_new_point(self, x, y, ac_to_shunt):
         # adds a point to the grid
-        self.point_position[ac_to_shunt] = {"x_bin": x, "y_bin": y}
-        if str(x) + "_" + str(y) not in self.coord_points:
-            self.coord_points[str(x) + "_" + str(y)] = []
-        self.coord_points[str(x) + "_" + str(y)].append(ac_to_shunt)
-        if x not in self.x_coords_points:
-            self.x_coords_points[x] = []
-        self.x_coords_points[x].append(ac_to_shunt)
-
-        if y not in self.y_coords_points:
-            self.y_coords_points[y] = []
-        self.y_coords_points[y].append(ac_to_shunt)
-
-    def _shunt_point(self, coord):
+        self._point_x[ac_to_shunt] = x
+        self._point_y[ac_to_shunt] = y
+        cell = y * (self.num_x_grid + 1) + x
+        if self._cell_rank[cell] < 0:
+            # bins are ranked in the order they are first used, which breaks ties between equally crowded bins
+            self._cell_rank[cell] = self._next_rank
+            self._next_rank += 1
+        self._cell_points[cell].append(ac_to_shunt)
+        self._cell_counts[cell] += 1
+        count = self._cell_counts[cell]
+        if count == 2:
+            self._num_overfull += 1
+        if count > 1:
+            heapq.heappush(self._overfull, (-count, self._cell_rank[cell], cell))
+
+    def _most_crowded_cell(self):
+        # returns the earliest used of the bins with the most points, discarding stale heap entries
+        while True:
+            count, rank, cell = self._overfull[0]
+            if self._cell_counts[cell] == -count:
+                return cell
+            heapq.heappop(self._overfull)
+
+    def _shunt_point(self, cell):
         # moves a point in the grid
-        x, y = coord.split('_')
-        ac_to_shunt = self.coord_points[coord][1]
-        x = int(x)
-        y = int(y)
+        x, y = cell % (self.num_x_grid + 1), cell // (self.num_x_grid + 1)
+        ac_to_shunt = self._cell_points[cell][1]
 
         # check if a neighbouring bin is empty and move to neighbouring bin
         for point in [(min(x + 1, self.num_x_grid), y), (min(x + 1, self.num_x_grid), min(y + 1, self.num_y_grid)),
                       (min(x + 1, self.num_x_grid), max(0, y - 1)),
                       (max(0, x - 1), y), (max(0, x - 1), min(y + 1, self.num_y_grid)), (max(0, x - 1), max(0, y - 1)),
                       (x, min(y + 1, self.num_y_grid)), (x, max(0, y - 1))]:
-            if len(self.coord_points.get(str(point[0]) + "_" + str(point[1]), [])) == 0:
+            if self.grid_counts[point[1], point[0]] == 0:
                 # delete old point
                 self._delete_old_point(x, y, ac_to_shunt)
 
                 # add new point
                 self._update_new_point(point[0], point[1], ac_to_shunt)
+                self.num_neighbour_moves += 1
                 return
 
         # move to a neighbouring bin in the direction that is most sparse
-        prop_x_plus_empty = 1. * len(
-            [i for i in range(x + 1, 51) if len(self.coord_points.get(str(i) + "_%d" % y, [])) == 0]) / (
+        self.num_cascades += 1
+        row = self.grid_counts[y]
+        column = self.grid_counts[:, x]
+        prop_x_plus_empty = 1. * np.count_nonzero(row[x + 1:] == 0) / (
                                 self.num_x_grid - x) if x != self.num_x_grid else 0
-        prop_x_minus_empty = 1. * len(
-            [i for i in range(x - 1, -1, -1) if len(self.coord_points.get(str(i) + "_%d" % y, [])) == 0]) / (
+        prop_x_minus_empty = 1. * np.count_nonzero(row[:x] == 0) / (
                                  x) if x != 0 else 0
 
-        prop_y_plus_empty = 1. * len(
-            [i for i in range(y + 1, 41) if len(self.coord_points.get("%d_" % x + str(i), [])) == 0]) / (
+        prop_y_plus_empty = 1. * np.count_nonzero(column[y + 1:] == 0) / (
                                 self.num_y_grid - y) if y != self.num_y_grid else 0
-        prop_y_minus_empty = 1. * len(
-            [i for i in range(y - 1, -1, -1) if len(self.coord_points.get("%d_" % x + str(i), [])) == 0]) / (
+        prop_y_minus_empty = 1. * np.count_nonzero(column[:y] == 0) / (
                                  y) if y != 0 else 0
 
+        # ties go to the first direction in this order
+        props = [prop_x_plus_empty, prop_x_minus_empty, prop_y_plus_empty, prop_y_minus_empty]
+        direction = props.index(max(props))
+
+        # points are moved while iterating over their bin, exactly as the original cascade did
         self._delete_old_point(x, y, ac_to_shunt)
-        if prop_x_plus_empty is max(prop_x_plus_empty, prop_x_minus_empty, prop_y_plus_empty, prop_y_minus_empty):
-            for idx in range(x + 1, 51)[::-1]:
-                if str(idx) + "_" + str(y) in self.coord_points:
-                    for ac in self.coord_points[str(idx) + "_" + str(y)]:
-                        self._delete_old_point(idx, y, ac)
-                        self._update_new_point(min(idx + 1, self.num_x_grid), y, ac)
+        moved = 0
+        if direction == 0:
+            for idx in range(self.num_x_grid, x, -1):
+                for ac in self._cell_points[y * (self.num_x_grid + 1) + idx]:
+                    self._delete_old_point(idx, y, ac)
+                    self._update_new_point(min(idx + 1, self.num_x_grid), y, ac)
+                    moved += 1
 
+            self.num_cascade_moves += moved + 1
             self._update_new_point(min(x + 1, self.num_x_grid), y, ac_to_shunt)
             return
-        if prop_x_minus_empty is max(prop_x_plus_empty, prop_x_minus_empty, prop_y_plus_empty, prop_y_minus_empty):
-            for idx in range(x - 1, -1, -1)[::-1]:
-                if str(idx) + "_" + str(y) in self.coord_points:
-                    for ac in self.coord_points[str(idx) + "_" + str(y)]:
-                        self._delete_old_point(idx, y, ac)
-                        self._update_new_point(max(idx - 1, 0), y, ac)
+        if direction == 1:
+            for idx in range(0, x):
+                for ac in self._cell_points[y * (self.num_x_grid + 1) + idx]:
+                    self._delete_old_point(idx, y, ac)
+                    self._update_new_point(max(idx - 1, 0), y, ac)
+                    moved += 1
 
+            self.num_cascade_moves += moved + 1
             self._update_new_point(max(x - 1, 0), y, ac_to_shunt)
             return
-        if prop_y_plus_empty is max(prop_x_plus_empty, prop_x_minus_empty, prop_y_plus_empty, prop_y_minus_empty):
-            for idx in range(y + 1, 41)[::-1]:
-                if str(x) + "_" + str(idx) in self.coord_points:
-                    for ac in self.coord_points[str(x) + "_" + str(idx)]:
-                        self._delete_old_point(x, idx, ac)
-                        self._update_new_point(x, min(idx + 1, self.num_y_grid), ac)
+        if direction == 2:
+            for idx in range(self.num_y_grid, y, -1):
+                for ac in self._cell_points[idx * (self.num_x_grid + 1) + x]:
+                    self._delete_old_point(x, idx, ac)
+                    self._update_new_point(x, min(idx + 1, self.num_y_grid), ac)
+                    moved += 1
 
+            self.num_cascade_moves += moved + 1
             self._update_new_point(x, min(y + 1, self.num_y_grid), ac_to_shunt)
             return
-        if prop_y_minus_empty is max(prop_x_plus_empty, prop_x_minus_empty, prop_y_plus_empty, prop_y_minus_empty):
-            for idx in range(y - 1, -1, -1)[::-1]:
-                if str(x) + "_" + str(idx) in self.coord_points:
-                    for ac in self.coord_points[str(x) + "_" + str(idx)]:
-                        self._delete_old_point(x, idx, ac)
-                        self._update_new_point(x, max(idx - 1, 0), ac)
+        if direction == 3:
+            for idx in range(0, y):
+                for ac in self._cell_points[idx * (self.num_x_grid + 1) + x]:
+                    self._delete_old_point(x, idx, ac)
+                    self._update_new_point(x, max(idx - 1, 0), ac)
+                    moved += 1
 
+            self.num_cascade_moves += moved + 1
             self._update_new_point(x, max(y - 1, 0), ac_to_shunt)
             return
 
-    def _populate_new_grid(self):
+    def _populate_new_grid(self, max_shunts=None, max_cascades=None):
         # shifts points in the grid such that no x, y pair in the grid has more than 1 point, while maintaining geographic resemblance
-        self.point_position = self.df.set_index(self.index_col)[['x_bin', 'y_bin']].to_dict(orient='index')
-
-        for point in self.point_position:
-            if self.point_position[point]['x_bin'] not in self.x_coords_points:
-                self.x_coords_points[self.point_position[point]['x_bin']] = []
-            if self.point_position[point]['y_bin'] not in self.y_coords_points:
-                self.y_coords_points[self.point_position[point]['y_bin']] = []
-            self.x_coords_points[self.point_position[point]['x_bin']].append(point)
-            self.y_coords_points[self.point_position[point]['y_bin']].append(point)
+        # returns False, leaving hex_x and hex_y unset, if that takes more than max_shunts shunts or max_cascades cascades
+        # points are referred to by their row position in self.df; bins are flattened row-major into cell = y * (num_x_grid + 1) + x
+        num_cells = (self.num_x_grid + 1) * (self.num_y_grid + 1)
+        self.grid_counts = np.zeros((self.num_y_grid + 1, self.num_x_grid + 1), dtype=np.int32)
+        self._cell_counts = self.grid_counts.reshape(-1)
+        self._cell_points = [[] for _ in range(num_cells)]
+        self._cell_rank = [-1] * num_cells
+        self._next_rank = 0
+        self._overfull = []
+        self._point_x = [0] * len(self.df)
+        self._point_y = [0] * len(self.df)
+        self._reset_counters()
 
-        for point, value in self.point_position.items():
-            if (str(value["x_bin"]) + "_" + str(value["y_bin"])) not in self.coord_points:
-                self.coord_points[str(value["x_bin"]) + "_" + str(value["y_bin"])] = []
-            self.coord_points[str(value["x_bin"]) + "_" + str(value["y_bin"])].append(point)
+        for point, (x, y) in enumerate(zip(self.df['x_bin'].tolist(), self.df['y_bin'].tolist())):
+            self._update_new_point(x, y, point)
 
+        progress = self.progress
         while not self._is_valid():
-            coord_to_shunt_from = max(self.coord_points, key=lambda x: len(self.coord_points[x]))
-            ac_to_shunt = self.coord_points[coord_to_shunt_from][1]
-            self._shunt_point(coord_to_shunt_from)
+            if (max_shunts is not None and self.num_shunts >= max_shunts) or (
+                    max_cascades is not None and self.num_cascades > max_cascades):
+                return False
+            self._shunt_point(self._most_crowded_cell())
+            self.num_shunts += 1
+            if progress is not None and self.num_shunts % self.progress_every == 0:
+                self._record_shunt_stats()
+                progress(self.stats)
+
+        self.df['hex_x'] = self._point_x
+        self.df['hex_y'] = self._point_y
+        return True
+
+    def _nearest_free_cells(self, x_bins, y_bins, occupied=None):
+        # greedily gives each point, in order, the free bin closest to its original bin; occupied marks bins that are
+        # already taken and is updated in place
+        if occupied is None:
+            occupied = np.zeros((self.num_y_grid + 1, self.num_x_grid + 1), dtype=bool)
+        cells_x = np.empty(len(x_bins), dtype=np.int64)
+        cells_y = np.empty(len(y_bins), dtype=np.int64)
+        for point, (x, y) in enumerate(zip(x_bins.tolist(), y_bins.tolist())):
+            radius = 1
+            while True:
+                x0, y0 = max(x - radius, 0), max(y - radius, 0)
+                window = occupied[y0:y + radius + 1, x0:x + radius + 1]
+                free_y, free_x = np.nonzero(~window)
+                if len(free_x) == 0:
+                    radius *= 2
+                    continue
+                distance = np.hypot(free_x + x0 - x, free_y + y0 - y)
+                nearest = distance.argmin()
+                # a free bin outside the window could only be closer if it were within `radius`
+                if distance[nearest] <= radius or window.size == occupied.size:
+                    cells_x[point], cells_y[point] = free_x[nearest] + x0, free_y[nearest] + y0
+                    occupied[cells_y[point], cells_x[point]] = True
+                    break
+                radius = int(np.ceil(distance[nearest]))
+        return cells_x, cells_y
+
+    def _nearest_free_hexes(self, x_bins, y_bins, occupied):
+        # like _nearest_free_cells, but measures distance in steps between hexes as they are drawn; each point searches
+        # a disc of hexes around its bin whose radius doubles until it holds a free hex, so a point only looks as far
+        # as the nearest free hex
+        width, height = self.num_x_grid + 1, self.num_y_grid + 1
+        assert occupied.sum() + len(x_bins) <= occupied.size, "Too few dimensions"
+        cells_x = np.empty(len(x_bins), dtype=np.int64)
+        cells_y = np.empty(len(y_bins), dtype=np.int64)
+        for point, (x, y) in enumerate(zip(x_bins.tolist(), y_bins.tolist())):
+            q = x - (y - (y & 1)) // 2
+            radius = 2
+            while True:
+                dq, dr, ring = _hex_disc(radius)
+                ys = y + dr
+                xs = q + dq + (ys - (ys & 1)) // 2
+                free = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+                free[free] = ~occupied[ys[free], xs[free]]
+                if free.any():
+                    break
+                radius *= 2
+            # the disc is ordered by ring, so the first free hex is in the nearest ring that has one
+            nearest = ring == ring[free.argmax()]
+            xs, ys = xs[free & nearest], ys[free & nearest]
+            # of the equally near free hexes, the one drawn closest to the bin wins
+            drawn = np.hypot(xs + 0.5 * (ys & 1) - x - 0.5 * (y & 1), (ys - y) * np.sqrt(3) / 2)
+            nearest = drawn.argmin()
+            cells_x[point], cells_y[point] = xs[nearest], ys[nearest]
+            occupied[cells_y[point], cells_x[point]] = True
+        return cells_x, cells_y
+
+    def _hex_new_grid(self):
+        # the first point in every bin stays there; each of the others moves to the free hex nearest to its bin, so a
+        # conflict only touches the hexes around it
+        x_bins = self.df['x_bin'].to_numpy(dtype=np.int64)
+        y_bins = self.df['y_bin'].to_numpy(dtype=np.int64)
+        _, first = np.unique(y_bins * (self.num_x_grid + 1) + x_bins, return_index=True)
+        moved = np.ones(len(self.df), dtype=bool)
+        moved[first] = False
+        occupied = np.zeros((self.num_y_grid + 1, self.num_x_grid + 1), dtype=bool)
+        occupied[y_bins[~moved], x_bins[~moved]] = True
+
+        hex_x, hex_y = x_bins.copy(), y_bins.copy()
+        hex_x[moved], hex_y[moved] = self._nearest_free_hexes(x_bins[moved], y_bins[moved], occupied)
+        self.num_shunts = int(moved.sum())
+        self.num_neighbour_moves = int(np.count_nonzero(
+            _hex_distance(x_bins[moved], y_bins[moved], hex_x[moved], hex_y[moved]) == 1))
+        self.df['hex_x'] = hex_x
+        self.df['hex_y'] = hex_y
+
+    def _place_new_grid(self, method):
+        # runs the layout method; the shunt heuristic runs without limits
+        if method == "shunt":
+            self._populate_new_grid()
+        elif method == "nearest":
+            self._hex_new_grid()
+        else:
+            self._assign_new_grid()
+
+    def _assign_new_grid(self, tile=16, passes=4):
+        # starts from a greedy placement and lowers its total displacement one tile of tile x tile bins at a time: the
+        # points placed in a tile are reassigned to the tile's bins by solving a minimum-total-displacement assignment.
+        # A solve can only lower the total, and every other pass shifts the tiles by half a tile so that points can
+        # move across tile edges. Each solve is at most tile**2 points by tile**2 bins, so the run time grows with the
+        # size of the grid rather than with how congested it is
+        try:
+            from scipy.optimize import linear_sum_assignment
+        except ImportError:
+            raise ImportError("method='assignment' requires scipy to be installed")
+
+        width, height = self.num_x_grid + 1, self.num_y_grid + 1
+        x_bins = self.df['x_bin'].to_numpy(dtype=np.int64)
+        y_bins = self.df['y_bin'].to_numpy(dtype=np.int64)
+        hex_x, hex_y = self._nearest_free_cells(x_bins, y_bins)
+
+        for i in range(passes):
+            offset = tile // 2 * (i % 2)
+            tile_x, tile_y = (hex_x + offset) // tile, (hex_y + offset) // tile
+            tiles = tile_y * (width // tile + 2) + tile_x
+            order = np.argsort(tiles, kind='stable')
+            starts = np.flatnonzero(np.diff(tiles[order])) + 1
+            for points in np.split(order, starts):
+                # a tile whose points are all in their own bins cannot be improved
+                if len(points) < 2 or ((hex_x[points] == x_bins[points]) & (hex_y[points] == y_bins[points])).all():
+                    continue
+                x0, y0 = tile_x[points[0]] * tile - offset, tile_y[points[0]] * tile - offset
+                cells_x, cells_y = [c.ravel() for c in np.meshgrid(np.arange(max(x0, 0), min(x0 + tile, width)),
+                                                                  np.arange(max(y0, 0), min(y0 + tile, height)))]
+                cost = np.hypot(cells_x - x_bins[points, None], cells_y - y_bins[points, None])
+                rows, columns = linear_sum_assignment(cost)
+                hex_x[points[rows]], hex_y[points[rows]] = cells_x[columns], cells_y[columns]
+
+        self.df['hex_x'] = hex_x
+        self.df['hex_y'] = hex_y
+
+    def _reset_counters(self):
+        # zeroes what a layout counts, which _record_shunt_stats copies into stats
+        self.num_shunts = self.num_neighbour_moves = self.num_cascades = self.num_cascade_moves = 0
+        self._num_overfull = 0
+
+    @contextlib.contextmanager
+    def _layout_phase(self, method, search_method=None):
+        # the setup and teardown every way of laying out shares: picks a grid size with search_method if none was
+        # given, bins the points, zeroes the counters and records method in stats, then runs the body as the layout
+        # phase; afterwards the counters are copied into stats and progress is called
+        if self.num_x_grid is None or self.num_y_grid is None:
+            with self.stats.phase("grid_search"):
+                self.auto_grid_size(search_method or method)
+        with self.stats.phase("binning"):
+            self._initialize_grid()
+        self.stats.method = method
+        self.stats.cache_hit = False
+        self._reset_counters()
+        with self.stats.phase("layout"):
+            yield
+        self._record_shunt_stats()
+        if self.progress is not None:
+            self.progress(self.stats)
 
-        self.df['hex_x'] = self.df[self.index_col].apply(lambda x: self.point_position[x]["x_bin"])
-        self.df['hex_y'] = self.df[self.index_col].apply(lambda x: self.point_position[x]["y_bin"])
+    def _record_shunt_stats(self):
+        # copies the shunt heuristic's counters into stats
+        self.stats.num_shunts = self.num_shunts
+        self.stats.neighbour_moves = self.num_neighbour_moves
+        self.stats.cascades = self.num_cascades
+        self.stats.cascade_moves = self.num_cascade_moves
+        self.stats.overfull_bins = self._num_overfull
 
-    def make_hex_svg(self, output_fname=None, show=False, draw_text=False):
+    def _measure_displacement(self):
+        # records how far, in bins, the layout moved each point from its original bin
+        displacement = np.hypot(self.df['hex_x'] - self.df['x_bin'], self.df['hex_y'] - self.df['y_bin'])
+        self.total_displacement = float(displacement.sum())
+        self.max_displacement = float(displacement.max())
+        self.stats.points_displaced = int(np.count_nonzero(displacement.to_numpy()))
+        self.stats.total_displacement = self.total_displacement
+        self.stats.max_displacement = self.max_displacement
+
+    def _layout(self, method):
+        # bins the points and places each one in its own bin using the chosen method
+        assert method in ("shunt", "nearest", "assignment", "keep"), (
+            "method must be 'shunt', 'nearest', 'assignment' or 'keep'")
+        if method == "keep":
+            assert "hex_x" in self.df.columns, "There is no layout to keep yet"
+            return
+        with self._layout_phase(method):
+            layout = None
+            if self.cache is not None:
+                key = self.cache.key(self.df[self.index_col].tolist(), self.df['longitude'].to_numpy(),
+                                     self.df['latitude'].to_numpy(), self.num_x_grid, self.num_y_grid, method,
+                                     LAYOUT_VERSION)
+                layout = self.cache.get(key)
+            self.stats.cache_hit = layout is not None
+            if layout is not None:
+                self.df['hex_x'] = np.asarray(layout[0], dtype=np.int64)
+                self.df['hex_y'] = np.asarray(layout[1], dtype=np.int64)
+            else:
+                self._place_new_grid(method)
+                if self.cache is not None:
+                    self.cache.put(key, self.df['hex_x'].to_numpy(), self.df['hex_y'].to_numpy())
+            self._measure_displacement()
+
+    def _grid_size_candidates(self, min_fill, max_fill, num_fills, aspect_factors):
+        # grids with the data's aspect ratio (stretched by aspect_factors) in which the areas fill between min_fill
+        # and max_fill of the bins
+        num_areas = len(self.df)
+        aspect = (self.max_longitude - self.min_longitude) / float(self.max_latitude - self.min_latitude)
+        candidates = []
+        for fill in np.linspace(min_fill, max_fill, num_fills):
+            for factor in aspect_factors:
+                num_x_grid = max(int(round(np.sqrt(num_areas / fill * aspect * factor))), 1)
+                num_y_grid = max(int(round(num_areas / fill / num_x_grid)), 1)
+                while num_x_grid * num_y_grid <= num_areas:
+                    num_y_grid += 1
+                if (num_x_grid, num_y_grid) not in candidates:
+                    candidates.append((num_x_grid, num_y_grid))
+        return candidates
+
+    def auto_grid_size(self, method="shunt", workers=None, sparsity_weight=1., min_fill=0.15, max_fill=0.6,
+                       num_fills=6, aspect_factors=(0.85, 1, 1.15)):
+        """ Chooses num_x_grid and num_y_grid by laying the areas out on candidate grids and scoring each layout
+            method: the layout method to score candidates with
+            workers: how many candidates are laid out in parallel (default: one per core; 1 runs them in this process)
+            sparsity_weight: how much empty bins count against a grid; lower it to prefer sparser maps
+            min_fill, max_fill, num_fills: the fractions of bins the areas should fill on the candidate grids
+            aspect_factors: how much the candidates may stretch the data's aspect ratio
+
+            A layout's score is the sum of its mean displacement and a tenth of its maximum displacement, both in
+            units of the typical spacing between areas, the number of cascade shifts per area, and sparsity_weight
+            times the fraction of empty bins. Lower is better. A candidate is stopped, or not laid out at all, as
+            soon as a lower bound on its score (from its empty bins, the points that share a bin before the layout,
+            and its cascade shifts so far) is worse than the best finished candidate.
+            The scores of all candidates are kept in grid_scores, best first.
+        """
+        num_areas = len(self.df)
+        candidates = self._grid_size_candidates(min_fill, max_fill, num_fills, aspect_factors)
+        workers = workers or os.cpu_count() or 1
+        # workers get a copy without the cache, geometries, any earlier layout, or the stats and progress callback
+        cart = copy.copy(self)
+        cart.cache = None
+        cart.stats = LayoutStats()
+        cart.progress = None
+        cart.df = self.df[[self.index_col, 'longitude', 'latitude']].copy()
+
+        results = []
+        best = None
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            # candidates are laid out in rounds, so each round is bounded by the best score of the rounds before
+            for start in range(0, len(candidates), workers):
+                jobs = []
+                for num_x_grid, num_y_grid in candidates[start:start + workers]:
+                    # every point beyond the first in a bin has to move at least one bin, which bounds the score
+                    x_bins, y_bins = self._calc_bins(num_x_grid, num_y_grid)
+                    must_move = num_areas - len(np.unique(y_bins.astype(np.int64) * (num_x_grid + 1) + x_bins))
+                    floor = _grid_score(num_areas, num_x_grid, num_y_grid, must_move / float(num_areas),
+                                        min(must_move, 1), 0, sparsity_weight)
+                    if best is not None and floor >= best:
+                        results.append({"num_x_grid": num_x_grid, "num_y_grid": num_y_grid, "finished": False,
+                                        "cascades": 0, "mean_displacement": None, "max_displacement": None,
+                                        "score": None})
+                        continue
+                    max_cascades = None if best is None else int((best - floor) * num_areas)
+                    jobs.append((cart, num_x_grid, num_y_grid, method, sparsity_weight, max_cascades))
+                if pool is None:
+                    results += [_score_grid_size(*job) for job in jobs]
+                else:
+                    results += list(pool.map(_score_grid_size, *zip(*jobs))) if jobs else []
+                scores = [result["score"] for result in results if result["finished"]]
+                best = min(scores) if scores else None
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        assert best is not None, "None of the candidate grids could be laid out"
+        self.grid_scores = pd.DataFrame(results).sort_values("score", na_position="last").reset_index(drop=True)
+        self.num_x_grid = int(self.grid_scores["num_x_grid"].iloc[0])
+        self.num_y_grid = int(self.grid_scores["num_y_grid"].iloc[0])
+        return self.num_x_grid, self.num_y_grid
+
+    def update_layout(self, layout, added=(), removed=(), changed=()):
+        """ Lays out the areas by repairing an earlier layout instead of starting from scratch
+            layout: a DataFrame with id_col, hex_x and hex_y columns, e.g. the df of the Cartogram that made it
+            added, removed, changed: ids of the areas added to, removed from, or moved in the input since then
+
+            Areas that were not added or changed keep their hex. Added and changed areas are each given the free hex
+            nearest to their bin, so only the grid around them is touched. Render the result with
+            make_hex_svg or make_hex_geojson and method="keep".
+        """
+        assert self.num_x_grid is not None and self.num_y_grid is not None, "update_layout needs the earlier grid size"
+        with self._layout_phase("update"):
+            self._update_layout(layout, added, removed, changed)
+
+    def _update_layout(self, layout, added, removed, changed):
+        # the layout phase of update_layout
+        # ids are compared as strings, since Chorogrid turns the id column of a rendered df into strings
+        ids = self.df[self.index_col].astype(str)
+        relayout = set(str(id_) for id_ in added).union(str(id_) for id_ in changed)
+        removed = set(str(id_) for id_ in removed)
+        assert not removed.intersection(ids), "Removed areas are still in the input"
+        previous = dict(zip(layout[self.index_col].astype(str), zip(layout['hex_x'], layout['hex_y'])))
+        kept = ~ids.isin(relayout).to_numpy()
+        missing = set(ids[kept]).difference(previous)
+        assert not missing, "No earlier hex for {}; were they added?".format(missing)
+
+        hex_x = np.empty(len(self.df), dtype=np.int64)
+        hex_y = np.empty(len(self.df), dtype=np.int64)
+        if kept.any():
+            hex_x[kept], hex_y[kept] = zip(*[previous[id_] for id_ in ids[kept]])
+        assert (hex_x[kept] <= self.num_x_grid).all() and (hex_y[kept] <= self.num_y_grid).all(), (
+            "The earlier layout does not fit in this grid")
+        occupied = np.zeros((self.num_y_grid + 1, self.num_x_grid + 1), dtype=bool)
+        occupied[hex_y[kept], hex_x[kept]] = True
+        assert occupied.sum() == kept.sum(), "The earlier layout puts several areas in one hex"
+
+        hex_x[~kept], hex_y[~kept] = self._nearest_free_cells(self.df['x_bin'].to_numpy(dtype=np.int64)[~kept],
+                                                              self.df['y_bin'].to_numpy(dtype=np.int64)[~kept],
+                                                              occupied)
+        self.df['hex_x'] = hex_x
+        self.df['hex_y'] = hex_y
+        self._measure_displacement()
+
+    def hierarchical_layout(self, method="shunt", workers=None):
+        """ Lays out the areas of every parent region (from parent_col) on its own block of the grid, in parallel
+            method: the layout method used within each block, "shunt", "nearest" or "assignment"; a block the shunt
+                    heuristic cannot finish is laid out with "nearest" instead
+            workers: how many blocks are laid out in parallel (default: one per core; 1 lays them out in this process)
+
+            The grid is cut in two between the regions on either side of the cut, where they meet on the grid, and
+            each half is cut again until every region has its own block; the cuts split the areas as evenly as they
+            can while leaving no half more than twice as full as the whole grid, or 90% full. Each region is then laid
+            out on its block from its areas' bins on the whole grid, moved (and squeezed if need be) to fit, so
+            congestion in one region cannot push areas into another, and the layout takes about as long as the largest
+            region does.
+            The blocks are kept in blocks as parent -> (x, y, width, height). Render the result with make_hex_svg or
+            make_hex_geojson and method="keep".
+        """
+        assert self.parent_col is not None, "hierarchical_layout needs the Cartogram to be made with a parent_col"
+        assert method in ("shunt", "nearest", "assignment"), "method must be 'shunt', 'nearest' or 'assignment'"
+        with self._layout_phase("hierarchical", search_method=method):
+            self._hierarchical_layout(method, workers)
+
+    def _hierarchical_layout(self, method, workers):
+        # the layout phase of hierarchical_layout
+        assert self.df[self.parent_col].notna().all(), "Some areas have no parent region"
+        regions = self.df.groupby(self.parent_col, sort=False).agg(
+            num_areas=('x_bin', 'size'), x_bin=('x_bin', 'mean'), y_bin=('y_bin', 'mean'))
+        # a block may be up to twice as full as the grid, which lets cuts follow the regions' boundaries
+        num_cells = (self.num_x_grid + 1) * (self.num_y_grid + 1)
+        self.blocks = _split_blocks(list(regions.itertuples(name=None)), 0, 0, self.num_x_grid + 1,
+                                    self.num_y_grid + 1, min(.9, 2. * len(self.df) / float(num_cells)),
+                                    [100 * len(regions)])
+        assert self.blocks is not None, "The grid is too small to give every parent region its own block"
+
+        # workers get a bare Cartogram of each region holding only what a layout needs, since a copy would also carry
+        # any earlier layout or rendering; the largest regions go first, so no worker is left with one at the end
+        rows = self.df.groupby(self.parent_col, sort=False).indices
+        parents = regions.sort_values('num_areas', ascending=False).index.tolist()
+        jobs = []
+        for parent in parents:
+            region = Cartogram.__new__(Cartogram)
+            region.index_col = self.index_col
+            region.cache = None
+            region.stats = LayoutStats()
+            region.progress = None
+            region.progress_every = self.progress_every
+            region.df = self.df.iloc[rows[parent]][[self.index_col, 'longitude', 'latitude']].reset_index(drop=True)
+            # each area starts from its bin on the whole grid
+            region.df['x_bin'] = self.df['x_bin'].to_numpy(dtype=np.int64)[rows[parent]] - self.blocks[parent][0]
+            region.df['y_bin'] = self.df['y_bin'].to_numpy(dtype=np.int64)[rows[parent]] - self.blocks[parent][1]
+            jobs.append((region, self.blocks[parent][2], self.blocks[parent][3], method))
+
+        hex_x = np.empty(len(self.df), dtype=np.int64)
+        hex_y = np.empty(len(self.df), dtype=np.int64)
+        workers = workers or os.cpu_count() or 1
+        if workers > 1 and len(jobs) > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(_layout_block, *zip(*jobs)))
+        else:
+            results = [_layout_block(*job) for job in jobs]
+        for parent, result in zip(parents, results):
+            x0, y0, _, _ = self.blocks[parent]
+            hex_x[rows[parent]] = x0 + result["hex_x"]
+            hex_y[rows[parent]] = y0 + result["hex_y"]
+            self.num_shunts += result["num_shunts"]
+            self.num_neighbour_moves += result["num_neighbour_moves"]
+            self.num_cascades += result["num_cascades"]
+            self.num_cascade_moves += result["num_cascade_moves"]
+        self.df['hex_x'] = hex_x
+        self.df['hex_y'] = hex_y
+        self._measure_displacement()
+
+    def _chorogrid(self, spacing_dict=None):
+        # a Chorogrid of the current layout; the size it draws at with spacing_dict is kept in total_width and
+        # total_height for _convert_coord_to_latlong
+        cg = Chorogrid(self.df, self.df[self.index_col].tolist(), ['#eeeeee'] * len(self.df), id_column=self.index_col)
+        self.total_width, self.total_height = cg._calc_total_size(
+            'hex_x', 'hex_y', True, spacing_dict if spacing_dict is not None else Chorogrid._default_spacing_dict())
+        return cg
+
+    def make_hex_svg(self, output_fname=None, show=False, draw_text=False, method="shunt"):
         """ Outputs an SVG file of the hexgrid
             output_fname: the outputfilepath
             show: whether or not the output should be displayed in the ipython notebook
             draw_text: whether or not the id_col text should be drawn on the map
+            method: "shunt" for the original heuristic, "nearest" to move areas that share a bin to the nearest free hex,
+                    "assignment" to minimise the total displacement one tile of the grid at a time (needs scipy), or
+                    "keep" to reuse the current layout, e.g. from update_layout
         """
         
-        if output_fname is not None and "/" in output_fname and not os.path.isdir(output_fname[:output_fname.rfind('/')]): #check if outputfilepath directory exists
-            raise IOError('The directory specified does not exist')
-        self._initialize_grid()
-        self._populate_new_grid()
-        cg = Chorogrid(self.df, self.df[self.index_col].tolist(), ['#eeeeee'] * len(self.df), id_column=self.index_col)
-        cg.draw_hex(draw_text=draw_text)
-        cg.done(save_filename=output_fname, show=show)
-        self.total_width = cg.total_width
-        self.total_height = cg.total_height
-        self.svgstring = cg.svgstring
+        if output_fname is not None:
+            _check_output_directory(output_fname)
+        self._layout(method)
+        with self.stats.phase("svg"):
+            cg = self._chorogrid()
+            cg.draw_hex(draw_text=draw_text)
+            cg.done(save_filename=output_fname, show=show)
+        self.chorogrid = cg
         return
 
-    def _convert_coord_to_latlong(self, point):
+    def frame_renderer(self, draw_text=False, method="shunt", missing_color='#eeeeee'):
+        """ Lays out the areas and draws the hexgrid once, returning a FrameRenderer that renders it with new fill
+            colors for every frame, e.g. of a time series or an election count
+            draw_text: whether or not the id_col text should be drawn on the map
+            method: the layout method, as in make_hex_svg
+            missing_color: the fill of areas a frame gives no color
+        """
+        self._layout(method)
+        with self.stats.phase("svg"):
+            cg = self._chorogrid()
+            cg.draw_hex(draw_text=draw_text)
+            renderer = FrameRenderer(cg.fill_template(), self.df[self.index_col].tolist(), missing_color)
+        return renderer
+
+    @property
+    def svgstring(self):
+        # built on demand from the last make_hex_svg, so large maps are only held in memory when asked for
+        # the other outputs do not draw the SVG, so there is none until make_hex_svg has been called
+        if 'chorogrid' not in self.__dict__:
+            raise AttributeError("svgstring is only set by make_hex_svg; call make_hex_svg first")
+        return self.chorogrid.svgstring
+
+    def _convert_coord_to_latlong(self, points):
         #converts the coordinate system to an approximate lat-long system
         #works fairly well for areas that are around the size of Europe, but not too well for larger areas
-        point = [[float(j) for j in i.split(",")] for i in point]
-        point = [[self.min_latitude + (self.max_latitude - self.min_latitude)*(i[0])/self.total_height,
-                  self.min_longitude + (self.max_longitude - self.min_longitude)*(1.*self.total_width - i[1])/(self.total_width)] for i in point]
-        return point
-
-    def make_hex_geojson(self, output_fname):
-        self.make_hex_svg()
-        dom = BeautifulSoup(self.svgstring, "lxml")
-        polygons = dom.findAll("polygon")
-        features = []
-        for polygon in polygons:
-            features.append({"geometry": {
-                "type": "Polygon",
-                "coordinates": [self._convert_coord_to_latlong(polygon.attrs['points'].split())]
-            },
-            "type": "Feature",
-            "id": polygon.attrs["id"],
-            "properties": {}
-        })
-        
-        geojson_dict = {"type": "FeatureCollection", "features": features}
-        
-        if "/" in output_fname and not os.path.isdir(output_fname[:output_fname.rfind('/')]): #check if outputfilepath directory exists
-            raise IOError('The directory specified does not exist')
-        
-        with open(output_fname, "w") as f:
-            json.dump(geojson_dict, f)
+        return np.stack([self.min_latitude + (self.max_latitude - self.min_latitude)*(points[..., 0])/self.total_height,
+                         self.min_longitude + (self.max_longitude - self.min_longitude)*(1.*self.total_width - points[..., 1])/(self.total_width)], axis=-1)
+
+    def make_hex_geojson(self, output_fname, method="shunt", newline_delimited=False):
+        """ Outputs a GeoJSON file of the hexgrid
+            output_fname: the outputfilepath
+            method: "shunt" for the original heuristic, "nearest" to move areas that share a bin to the nearest free hex,
+                    "assignment" to minimise the total displacement one tile of the grid at a time (needs scipy), or
+                    "keep" to reuse the current layout, e.g. from update_layout
+            newline_delimited: write one Feature per line instead of a FeatureCollection
+        """
+        _check_output_directory(output_fname)
+
+        self._layout(method)
+        with self.stats.phase("geojson"):
+            vertices = self._chorogrid().hex_vertices()
+            # an (n, 6, 2) array; each feature's ring is only turned into lists as it is written
+            polygons = self._convert_coord_to_latlong(vertices)
+
+            with open(output_fname, "w") as f:
+                if not newline_delimited:
+                    f.write('{"type": "FeatureCollection", "features": [')
+                for i, (id_, polygon) in enumerate(zip(self.df[self.index_col], polygons)):
+                    feature = json.dumps({"geometry": {
+                        "type": "Polygon",
+                        "coordinates": [polygon.tolist()]
+                    },
+                    "type": "Feature",
+                    "id": id_,
+                    "properties": {}
+                })
+                    if newline_delimited:
+                        f.write(feature + "\n")
+                    else:
+                        f.write(feature if i == 0 else ", " + feature)
+                if not newline_delimited:
+                    f.write(']}')
+
+    def make_hex_topojson(self, output_fname, method="shunt"):
+        """ Outputs a TopoJSON file of the hexgrid, in the coordinates make_hex_geojson uses
+            output_fname: the outputfilepath
+            method: the layout method, as in make_hex_geojson
+
+            The hexes are drawn without the gutter between them, so that neighbouring hexes share edges and every edge
+            is written once as an arc. Hex vertices lie on a lattice of half a hex's width by a quarter of its height,
+            which is used as the quantization, so no precision is lost.
+        """
+        _check_output_directory(output_fname)
+
+        self._layout(method)
+        with self.stats.phase("topojson"):
+            spacing = Chorogrid._default_spacing_dict()
+            spacing['gutter'] = 0
+            vertices = self._chorogrid(spacing).hex_vertices(spacing_dict=spacing)
+            # svg x and y -> lattice positions; both axes are scaled independently by _convert_coord_to_latlong
+            origin = np.array([spacing['margin_left'], spacing['margin_top']], dtype=float)
+            step = np.array([spacing['cell_width'] / 2., spacing['cell_width'] / np.sqrt(3) / 2])
+            lattice = np.rint((vertices - origin) / step).astype(np.int64)
+            scale = self._convert_coord_to_latlong(origin + step) - self._convert_coord_to_latlong(origin)
+            # positions are counted from the corner the scale points away from, so they are never negative
+            corner = np.where(scale >= 0, lattice.min(axis=(0, 1)), lattice.max(axis=(0, 1)))
+            lattice = np.abs(lattice - corner)
+            translate = self._convert_coord_to_latlong(origin + corner * step)
+
+            # every edge of every hex, as a pair of vertex numbers; an arc runs from the lower to the higher number
+            width = lattice[..., 0].max() + 1
+            points = lattice[..., 1] * width + lattice[..., 0]
+            num_points = points.max() + 1
+            starts, ends = points.reshape(-1), np.roll(points, -1, axis=1).reshape(-1)
+            edges, arc = np.unique(np.minimum(starts, ends) * num_points + np.maximum(starts, ends),
+                                   return_inverse=True)
+            arc_starts, arc_ends = np.divmod(edges, num_points)
+            arc_starts = np.stack([arc_starts % width, arc_starts // width], axis=-1)
+            arc_ends = np.stack([arc_ends % width, arc_ends // width], axis=-1)
+            # arcs are delta-encoded; an edge walked from its higher numbered end refers to its arc as ~arc
+            arcs = np.stack([arc_starts, arc_ends - arc_starts], axis=1).tolist()
+            rings = np.where(starts < ends, arc, ~arc).reshape(-1, 6).tolist()
+
+            geometries = [{"type": "Polygon", "arcs": [ring], "id": id_}
+                          for id_, ring in zip(self.df[self.index_col], rings)]
+            topology = {"type": "Topology",
+                        "transform": {"scale": np.abs(scale).tolist(), "translate": translate.tolist()},
+                        "objects": {"hexgrid": {"type": "GeometryCollection", "geometries": geometries}},
+                        "arcs": arcs}
+            # json.dump would stream through the much slower pure Python encoder
+            with open(output_fname, "w") as f:
+                f.write(json.dumps(topology, separators=(",", ":")))
+
+    def make_hex_table(self, output_fname, method="shunt"):
+        """ Outputs the layout as a Parquet or Arrow (Feather) file, chosen by the extension of output_fname, with
+            one row per area: id_col, hex_x, hex_y, the area's original longitude and latitude, the centre of its hex
+            in the coordinates make_hex_geojson uses (hex_lon, hex_lat), and its displacement in bins. Needs pyarrow.
+            output_fname: the outputfilepath, ending in .parquet, .arrow or .feather
+            method: the layout method, as in make_hex_geojson
+        """
+        assert output_fname.endswith((".parquet", ".arrow", ".feather")), (
+            "output_fname must end in .parquet, .arrow or .feather")
+        _check_output_directory(output_fname)
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError("make_hex_table requires pyarrow to be installed")
+
+        self._layout(method)
+        with self.stats.phase("table"):
+            vertices = self._chorogrid().hex_vertices()
+            centres = self._convert_coord_to_latlong(vertices.mean(axis=1))
+            table = pd.DataFrame({self.index_col: self.df[self.index_col].to_numpy(),
+                                  'hex_x': self.df['hex_x'].to_numpy(dtype=np.int32),
+                                  'hex_y': self.df['hex_y'].to_numpy(dtype=np.int32),
+                                  'longitude': self.df['longitude'].to_numpy(),
+                                  'latitude': self.df['latitude'].to_numpy(),
+                                  'hex_lon': centres[:, 1], 'hex_lat': centres[:, 0],
+                                  'displacement': np.hypot(self.df['hex_x'] - self.df['x_bin'],
+                                                           self.df['hex_y'] - self.df['y_bin']).to_numpy()})
+            if output_fname.endswith(".parquet"):
+                table.to_parquet(output_fname, index=False)
+            else:
+                table.to_feather(output_fname)
@@ -0,0 +1,109 @@
+import concurrent.futures
+import os
+
+import pandas as pd
+
+from chorogrid import Chorogrid
+
+# the renderer of a worker process in FrameRenderer.write_frames, sent once when the worker starts
+_worker_renderer = None
+
+
+def _init_worker(renderer):
+    global _worker_renderer
+    _worker_renderer = renderer
+
+
+def _write_worker_frame(fills, output_fname):
+    _worker_renderer._write(fills, output_fname)
+    return output_fname
+
+
+class FrameRenderer(object):
+    """ Renders one hexgrid layout many times with different fill colors, e.g. the frames of a time series.
+        Made by Cartogram.frame_renderer, which lays out the areas and draws the hexagons once, instantiated with:
+            parts: the SVG document split where the fills go, from Chorogrid.fill_template
+            ids: the id of every hexagon, in the order of the fills
+            missing_color: the fill of areas a frame gives no color
+
+        A frame only looks up a color for every area and joins the parts of the document around them.
+    """
+
+    def __init__(self, parts, ids, missing_color='#eeeeee'):
+        assert len(parts) == len(ids) + 1, "There must be one more part than ids"
+        self.parts = parts
+        self.ids = pd.Index([str(id_) for id_ in ids])
+        self.missing_color = missing_color
+
+    def _fills(self, colors):
+        # the escaped fill of every hexagon
+        # ids are compared as strings, since Chorogrid turns the id column into strings
+        colors = pd.Series(colors, dtype=object)
+        colors.index = colors.index.astype(str)
+        assert colors.index.is_unique, "A frame gives some ids more than one color"
+        fills = colors.reindex(self.ids).to_numpy(copy=True)
+        fills[pd.isnull(fills)] = self.missing_color
+        # colors repeat a lot, so each one is only escaped once
+        escaped = {color: Chorogrid._escape(str(color)) for color in set(fills.tolist())}
+        return [escaped[color] for color in fills.tolist()]
+
+    def _value_colors(self, values, colormap):
+        # id -> color for a Series of id -> value; areas without a value get no color
+        values = values.dropna()
+        if callable(colormap):
+            return pd.Series(list(colormap(values.to_numpy())), index=values.index, dtype=object)
+        return values.map(colormap)
+
+    def _frames(self, frames, colormap):
+        # (name, fills) of every frame
+        if isinstance(frames, pd.DataFrame):
+            assert colormap is not None, "A DataFrame of values needs a colormap"
+            return [(name, self._fills(self._value_colors(frames[name], colormap))) for name in frames.columns]
+        if colormap is not None:
+            return [(i, self._fills(self._value_colors(pd.Series(frame), colormap))) for i, frame in enumerate(frames)]
+        return [(i, self._fills(frame)) for i, frame in enumerate(frames)]
+
+    def _join(self, fills):
+        document = [None] * (2 * len(fills) + 1)
+        document[::2] = self.parts
+        document[1::2] = fills
+        return ''.join(document)
+
+    def _write(self, fills, output_fname):
+        with open(output_fname, 'w', encoding='utf-8') as f:
+            f.write(self._join(fills))
+
+    def render(self, colors, colormap=None):
+        """ Returns the SVG of one frame as a string
+            colors: a mapping (e.g. a dict or Series) of id -> fill color, or of id -> value if colormap is given
+            colormap: turns values into colors; either a mapping of value -> color, or a function that takes an array
+                      of values and returns a color for each
+        """
+        if colormap is not None:
+            colors = self._value_colors(pd.Series(colors), colormap)
+        return self._join(self._fills(colors))
+
+    def write_frames(self, frames, output_fname, colormap=None, workers=1):
+        """ Writes one SVG file per frame and returns their paths
+            frames: a sequence of mappings of id -> fill color (or id -> value if colormap is given), or a DataFrame
+                    of values indexed by id with one column per frame
+            output_fname: the path of every frame, with {} where the frame's position (or column name) goes, e.g.
+                          "frames/turnout_{}.svg"
+            colormap: turns values into colors, as in render
+            workers: how many frames are written in parallel (None for one per core; 1, the default, writes them here)
+        """
+        # imported here, since eqcart.eqcart imports this module
+        from .eqcart import _check_output_directory
+        assert "{}" in output_fname, "output_fname needs a {} for the frame"
+        _check_output_directory(output_fname)
+        jobs = [(fills, output_fname.format(name)) for name, fills in self._frames(frames, colormap)]
+        workers = workers or os.cpu_count() or 1
+        if workers == 1 or len(jobs) < 2:
+            for fills, fname in jobs:
+                self._write(fills, fname)
+        else:
+            # the document parts go to every worker once, instead of with every frame
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                        initargs=(self,)) as pool:
+                list(pool.map(_write_worker_frame, *zip(*jobs)))
+        return [fname for _, fname in jobs]
@@ -0,0 +1,67 @@
+import contextlib
+import time
+import tracemalloc
+
+
+class LayoutStats(object):
+    """ Where the time of a Cartogram went, filled in as it works:
+            seconds: phase name -> wall time of the last run of that phase, in the order the phases first ran
+                (ingest, grid_search, binning, layout, svg, geojson, topojson and table)
+            peak_bytes: phase name -> the most memory allocated during the phase; only if trace_memory is set,
+                since tracing memory slows everything down
+            method: the layout method of the last layout, and whether it was read from the cache
+            num_shunts: how many times the layout moved a point out of a crowded bin, of which neighbour_moves went
+                into an adjacent bin; the shunt heuristic moves the rest by cascades (shifting a whole row or column)
+            cascade_moves: how many points all cascades moved together
+            overfull_bins: bins still holding more than one point; 0 once a layout is finished
+            points_displaced: how many points the layout placed outside their original bin
+            total_displacement, max_displacement: how far, in bins, the layout moved points
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.seconds = {}
+        self.peak_bytes = {}
+        self.method = None
+        self.cache_hit = False
+        self.num_shunts = 0
+        self.neighbour_moves = 0
+        self.cascades = 0
+        self.cascade_moves = 0
+        self.overfull_bins = 0
+        self.points_displaced = None
+        self.total_displacement = None
+        self.max_displacement = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        # times the enclosed block as the named phase
+        if self.trace_memory:
+            # if something else is already tracing memory it is left running
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            else:
+                tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = time.perf_counter() - start
+            if self.trace_memory:
+                self.peak_bytes[name] = tracemalloc.get_traced_memory()[1]
+                if started:
+                    tracemalloc.stop()
+
+    def as_dict(self):
+        # a JSON-serialisable copy
+        return {"seconds": dict(self.seconds), "peak_bytes": dict(self.peak_bytes), "method": self.method,
+                "cache_hit": self.cache_hit, "num_shunts": self.num_shunts, "neighbour_moves": self.neighbour_moves,
+                "cascades": self.cascades, "cascade_moves": self.cascade_moves, "overfull_bins": self.overfull_bins,
+                "points_displaced": self.points_displaced, "total_displacement": self.total_displacement,
+                "max_displacement": self.max_displacement}
+
+    def __repr__(self):
+        phases = ", ".join("{} {:.3f}s".format(name, seconds) for name, seconds in self.seconds.items())
+        return "LayoutStats({}; {} shunts, {} cascades moving {} points, {} points displaced)".format(
+            phases, self.num_shunts, self.cascades, self.cascade_moves, self.points_displaced)
@@ -9,5 +9,6 @@ setup(name='EqualAreaCartogram',
       keywords=['cartography', 'data visualization', 'dataviz'],
       license='MIT',
       packages=['eqcart', 'chorogrid'],
-      install_requires=['beautifulsoup4','pandas','geopandas'],
+      install_requires=['numpy','pandas','geopandas'],
+      entry_points={'console_scripts': ['eqcart=eqcart.cli:main']},
       zip_safe=False)
\ No newline at end of file